@@ -10,12 +10,14 @@ class CartItemInline(admin.TabularInline):
 
 @admin.register(Cart)
 class CartAdmin(admin.ModelAdmin):
-    list_display = ('session_key', 'total_items', 'subtotal', 'created_at',
+    list_display = ('session_key', 'user', 'item_count', 'subtotal', 'created_at',
                     'updated_at')
     list_filter = ('created_at', 'updated_at')
-    search_fields = ('session_key',)
+    search_fields = ('session_key', 'user__email')
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
     inlines = [CartItemInline]
-    readonly_fields = ('total_items', 'subtotal')
+    readonly_fields = ('item_count', 'subtotal')
 
 
 @admin.register(CartItem)
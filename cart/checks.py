@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Error, register
+from django.utils.module_loading import import_string
+from main.checks import PER_PROCESS_CACHES
+
+
+@register()
+def check_cart_storage_cache(app_configs, **kwargs):
+    from .storage import CacheCartStorage
+
+    if not issubclass(import_string(settings.CART_STORAGE), CacheCartStorage):
+        return []
+    alias = settings.CART_STORAGE_CACHE
+    backend = settings.CACHES.get(alias, {}).get('BACKEND')
+    if backend not in PER_PROCESS_CACHES:
+        return []
+    return [Error(
+        f'CacheCartStorage cannot buffer cart additions in the {alias!r} '
+        f'cache ({backend}).',
+        hint='Point CART_STORAGE_CACHE at a cache shared by every process, '
+             'such as Redis or Memcached, or use DatabaseCartStorage.',
+        id='cart.E001',
+    )]
@@ -1,15 +1,12 @@
-from .models import Cart
-
-
 def cart_processor(request):
-    if not request.session.session_key:
-        request.session.create()
-
-    cart, created = Cart.objects.get_or_create(
-        session_key = request.session.session_key
-    )
+    summary = getattr(request, 'cart_summary', None)
+    if summary is None:
+        return {}
 
+    # Callables are only evaluated by templates that actually use them, and
+    # the summary runs its aggregate at most once per request.
     return {
-        'cart_total_items': cart.total_items,
-        'cart_suntotal': cart.subtotal,
+        'cart_summary': summary,
+        'cart_total_items': lambda: summary.total_items,
+        'cart_suntotal': lambda: summary.subtotal,
     }
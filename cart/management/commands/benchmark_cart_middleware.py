@@ -0,0 +1,68 @@
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils.deprecation import MiddlewareMixin
+from cart.models import Cart
+from main.management.rollback import rolled_back
+from main.models import Product
+
+
+class EagerCartMiddleware(MiddlewareMixin):
+    """The previous middleware: a session and a cart row on every request."""
+
+    def process_request(self, request):
+        if not request.session.session_key:
+            request.session.create()
+
+        request.cart, created = Cart.objects.get_or_create(
+            session_key=request.session.session_key
+        )
+
+
+class Command(BaseCommand):
+    help = 'Count the queries an anonymous first visit costs per path'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('paths', nargs='*')
+
+
+    def handle(self, *args, **options):
+        paths = options['paths'] or self.default_paths()
+        lazy = self.measure(paths)
+
+        from django.conf import settings
+        middleware = [
+            'cart.management.commands.benchmark_cart_middleware.EagerCartMiddleware'
+            if name == 'cart.middleware.CartMiddleware' else name
+            for name in settings.MIDDLEWARE
+        ]
+        with override_settings(MIDDLEWARE=middleware):
+            eager = self.measure(paths)
+
+        self.stdout.write(f'{"path":<40} {"eager":>6} {"lazy":>6} {"saved":>6}')
+        for path in paths:
+            self.stdout.write(
+                f'{path:<40} {eager[path]:>6} {lazy[path]:>6} '
+                f'{eager[path] - lazy[path]:>6}'
+            )
+
+
+    def default_paths(self):
+        paths = ['/', '/catalog/', '/admin/login/', '/cart/count/']
+        product = Product.objects.order_by('id').first()
+        if product:
+            paths.append(f'/product/{product.slug}')
+        return paths
+
+
+    def measure(self, paths):
+        counts = {}
+        with rolled_back(), override_settings(ALLOWED_HOSTS=['*']):
+            for path in paths:
+                client = Client()
+                with CaptureQueriesContext(connection) as queries:
+                    client.get(path, HTTP_HX_REQUEST='true')
+                counts[path] = len(queries)
+        return counts
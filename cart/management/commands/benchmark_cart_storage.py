@@ -0,0 +1,86 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from cart.models import Cart
+from cart.storage import load_cart_storage
+from main.management.rollback import rolled_back
+from main.models import Category, Product, ProductSize, Size
+
+
+BACKENDS = (
+    ('database', 'cart.storage.DatabaseCartStorage'),
+    ('cache', 'cart.storage.CacheCartStorage'),
+)
+
+
+class Command(BaseCommand):
+    help = 'Compare add-to-cart throughput of the cart storage backends ' \
+           'on a generated product. Everything it writes is rolled back.'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sessions', type=int, default=20)
+        parser.add_argument('--adds', type=int, default=10,
+                            help='Additions per session')
+
+
+    def handle(self, *args, **options):
+        self.stdout.write(
+            f'{"backend":<10} {"adds/s":>8} {"queries/add":>12} '
+            f'{"flush s":>8} {"consistent":>11}'
+        )
+        with rolled_back():
+            # Every add reserves an item, so the size has stock for all of them.
+            product_size = self.generate(
+                options['sessions'] * options['adds'] * len(BACKENDS)
+            )
+            for name, path in BACKENDS:
+                with override_settings(CART_STORAGE=path, ALLOWED_HOSTS=['*']):
+                    self.run(name, path, product_size, options)
+
+
+    def generate(self, stock):
+        category = Category.objects.create(name='Benchmark',
+                                           slug='benchmark-cart-storage')
+        product = Product.objects.create(name='Benchmark',
+                                         slug='benchmark-cart-storage',
+                                         category=category, color='Black',
+                                         price='10.00')
+        return ProductSize.objects.create(product=product, stock=stock,
+                                          size=Size.objects.create(name='M'))
+
+
+    def run(self, name, path, product_size, options):
+        url = reverse('cart:add_to_cart', args=[product_size.product.slug])
+        data = {'size_id': product_size.pk, 'quantity': 1}
+        clients = [Client() for _ in range(options['sessions'])]
+        # Reading Client.session starts a session outside the timed loop.
+        session_keys = [client.session.session_key for client in clients]
+        adds = 0
+        with CaptureQueriesContext(connection) as queries:
+            started = time.perf_counter()
+            for _ in range(options['adds']):
+                for client in clients:
+                    client.post(url, data)
+                    adds += 1
+            elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        storage = load_cart_storage(path)
+        while storage.flush_dirty()[0]:
+            pass
+        flush_elapsed = time.perf_counter() - started
+
+        counts = Cart.objects.filter(session_key__in=session_keys) \
+            .values_list('item_count', flat=True)
+        consistent = sorted(counts) == [options['adds']] * len(clients)
+
+        self.stdout.write(
+            f'{name:<10} {adds / elapsed:>8.0f} '
+            f'{len(queries) / adds:>12.1f} {flush_elapsed:>8.3f} '
+            f'{"yes" if consistent else "NO":>11}'
+        )
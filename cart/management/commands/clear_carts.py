@@ -0,0 +1,70 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management import call_command
+from django.core.management.base import BaseCommand
+from django.db.models import Exists, OuterRef, Q
+from django.utils import timezone
+from cart.models import Cart
+
+
+DB_SESSION_ENGINES = (
+    'django.contrib.sessions.backends.db',
+    'django.contrib.sessions.backends.cached_db',
+)
+
+
+class Command(BaseCommand):
+    help = 'Delete carts whose session expired or that have been idle too long'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--idle-days', type=int, default=30)
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches')
+        parser.add_argument('--clear-sessions', action='store_true',
+                            help='Run clearsessions once the carts are gone')
+
+
+    def handle(self, *args, **options):
+        now = timezone.now()
+        abandoned = Q(updated_at__lt=now - timedelta(days=options['idle_days']))
+        if settings.SESSION_ENGINE in DB_SESSION_ENGINES:
+            live_session = Session.objects.filter(
+                session_key=OuterRef('session_key'),
+                expire_date__gt=now,
+            )
+            # Carts of signed-in users outlive any one session.
+            abandoned |= Q(user__isnull=True) & ~Exists(live_session)
+        carts = Cart.objects.filter(abandoned).order_by('pk') \
+            .values_list('pk', flat=True)
+
+        deleted = {}
+        last_pk = 0
+        started = time.perf_counter()
+        while True:
+            batch = list(carts.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1]
+
+            total, per_model = Cart.objects.filter(pk__in=batch).delete()
+            for label, count in per_model.items():
+                deleted[label] = deleted.get(label, 0) + count
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        elapsed = time.perf_counter() - started
+
+        rows = sum(deleted.values())
+        details = ', '.join(f'{count} {label}' for label, count in sorted(deleted.items()))
+        self.stdout.write(self.style.SUCCESS(
+            f'Deleted {rows} rows ({details or "nothing"}) in {elapsed:.2f}s, '
+            f'{rows / elapsed if elapsed else 0:.0f} rows/s'
+        ))
+
+        if options['clear_sessions']:
+            call_command('clearsessions')
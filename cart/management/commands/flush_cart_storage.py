@@ -0,0 +1,32 @@
+import time
+
+from django.core.management.base import BaseCommand
+from cart.storage import get_cart_storage
+
+
+class Command(BaseCommand):
+    help = 'Write cart additions buffered by the cart storage to the database'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=500)
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep running, sleeping this many seconds '
+                                 'between passes')
+
+
+    def handle(self, *args, **options):
+        storage = get_cart_storage()
+        while True:
+            total = 0
+            while True:
+                entries, flushed = storage.flush_dirty(options['batch_size'])
+                total += flushed
+                if not entries:
+                    break
+
+            if total or not options['interval']:
+                self.stdout.write(f'Flushed {total} items')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from cart.models import Cart
+
+
+class Command(BaseCommand):
+    help = 'Recompute Cart.item_count and Cart.subtotal where they drifted from the items'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--dry-run', action='store_true')
+
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        drifted = Cart.objects.drifted().order_by('pk').values_list('pk', flat=True)
+
+        repaired = 0
+        last_pk = 0
+        while True:
+            batch = list(drifted.filter(pk__gt=last_pk)[:batch_size])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            if not options['dry_run']:
+                Cart.objects.filter(pk__in=batch).repair_totals()
+            repaired += len(batch)
+
+        verb = 'Would repair' if options['dry_run'] else 'Repaired'
+        self.stdout.write(self.style.SUCCESS(f'{verb} {repaired} carts'))
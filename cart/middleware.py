@@ -1,14 +1,198 @@
+from django.conf import settings
+from django.contrib.auth import SESSION_KEY
+from django.db import transaction
+from django.db.models import Sum
+from django.utils.crypto import get_random_string
 from django.utils.deprecation import MiddlewareMixin
+from django.utils.functional import SimpleLazyObject, cached_property
 from .models import Cart
+from .storage import get_cart_storage
+from main.models import StockReservation
+from main.stock import adjust_reservations, transfer_reservations
+
+
+SIGNED_COOKIES_ENGINE = 'django.contrib.sessions.backends.signed_cookies'
+CART_KEY = '_cart_key'
+
+
+def cart_session_key(request, create=False):
+    """Return the key the session's cart is stored under.
+
+    Server-side sessions have a stable key of their own. A signed-cookie
+    session's key changes with its contents, so a random key is kept in the
+    session instead; it survives login because ``cycle_key`` keeps the data.
+    """
+    session = request.session
+    if settings.SESSION_ENGINE != SIGNED_COOKIES_ENGINE:
+        if create and not session.session_key:
+            session.create()
+        return session.session_key
+
+    key = session.get(CART_KEY)
+    if key is None and create:
+        key = session[CART_KEY] = get_random_string(32)
+    return key
+
+
+def session_user_id(request):
+    # Anonymous sessions never load a user. Signed-in ones go through
+    # request.user, whose session auth hash check drops sessions that a
+    # password change has invalidated.
+    if SESSION_KEY not in request.session:
+        return None
+    user = getattr(request, 'user', None)
+    return user.pk if user is not None and user.is_authenticated else None
+
+
+def resolve_cart(request):
+    """Return the visitor's cart without writing anything.
+
+    Signed-in users get the cart linked to their account, whichever device
+    created it; everyone else gets the session's cart. Users who signed in
+    before carts were linked to accounts still have an unlinked session
+    cart, which they keep seeing until ``get_or_create_cart`` claims it.
+    Visitors who never added a product get an unsaved ``Cart``; it reads as
+    empty and is only inserted by ``get_or_create_cart``.
+    """
+    session_key = cart_session_key(request)
+    user_id = session_user_id(request)
+    cart = None
+    if user_id:
+        cart = Cart.objects.filter(user_id=user_id).first()
+    if cart is None and session_key:
+        cart = Cart.objects.filter(session_key=session_key,
+                                   user__isnull=True).first()
+    return cart or Cart(session_key=session_key, user_id=user_id)
+
+
+def get_or_create_cart(request):
+    session_key = cart_session_key(request, create=True)
+    user_id = session_user_id(request)
+    if user_id:
+        if not Cart.objects.filter(user_id=user_id).exists():
+            # The session cart is unique by key, so link it rather than
+            # inserting a second row for the user.
+            Cart.objects.filter(session_key=session_key, user__isnull=True) \
+                .update(user_id=user_id)
+        cart, created = Cart.objects.get_or_create(
+            user_id=user_id,
+            defaults={'session_key': session_key},
+        )
+    else:
+        cart, created = Cart.objects.get_or_create(session_key=session_key)
+    request.cart = cart
+    return cart
+
+
+@transaction.atomic
+def attach_user_cart(request, previous_session_key):
+    """Link the cart of the session that just signed in to the user.
+
+    ``login()`` rotates the session key, so the anonymous cart is looked up
+    by the key from before. When the user already has a cart from another
+    device, the anonymous lines are merged into it. Either way the cart
+    takes the new session key, and so do its stock reservations.
+    """
+    user = request.user
+    session_key = cart_session_key(request, create=True)
+    storage = get_cart_storage()
+
+    user_cart = Cart.objects.select_for_update().filter(user=user).first()
+    anonymous = None
+    if previous_session_key:
+        storage.flush(previous_session_key)
+        anonymous = Cart.objects.select_for_update().filter(
+            session_key=previous_session_key,
+            user__isnull=True,
+        ).first()
+
+    if user_cart is None and anonymous is None:
+        return None
+
+    held_by = {previous_session_key} if previous_session_key else set()
+    if user_cart is None:
+        user_cart, anonymous = anonymous, None
+        user_cart.user = user
+    else:
+        storage.flush(user_cart.session_key)
+        held_by.add(user_cart.session_key)
+        if anonymous is not None:
+            user_cart.merge_from(anonymous)
+
+    user_cart.session_key = session_key
+    user_cart.save(update_fields=['user', 'session_key', 'updated_at'])
+    transfer_reservations(held_by, session_key)
+    # Merged lines are clamped to the stock, so give back whatever the two
+    # sessions held beyond the quantities the cart ended up with.
+    quantities = dict(user_cart.items.order_by().values('product_size_id')
+                      .annotate(total=Sum('quantity'))
+                      .values_list('product_size_id', 'total'))
+    adjust_reservations(session_key, {
+        size_id: quantities.get(size_id, 0) - quantity
+        for size_id, quantity in StockReservation.objects
+        .filter(session_key=session_key)
+        .values_list('product_size_id', 'quantity')
+        if quantity > quantities.get(size_id, 0)
+    })
+
+    request.cart = user_cart
+    if hasattr(request, 'cart_summary'):
+        request.cart_summary.refresh()
+    return user_cart
+
+
+class CartSummary:
+    """Item count and subtotal of the session's cart, read once per request.
+
+    Both come from the denormalized columns on the cart row, which is the
+    same row ``request.cart`` resolves, so the header badge costs no extra
+    query on pages that also touch the cart. Additions the cart storage has
+    not flushed yet are counted on top.
+    """
+
+    def __init__(self, request):
+        self.request = request
+
+
+    @cached_property
+    def totals(self):
+        cart = getattr(self.request, 'cart', None)
+        if cart is None:
+            cart = resolve_cart(self.request)
+        pending_items, pending_subtotal = get_cart_storage() \
+            .pending_totals(cart.session_key)
+        return {
+            'total_items': cart.item_count + pending_items,
+            'subtotal': cart.subtotal + pending_subtotal,
+        }
+
+
+    @property
+    def total_items(self):
+        return self.totals['total_items']
+
+
+    @property
+    def subtotal(self):
+        return self.totals['subtotal']
+
+
+    def refresh(self):
+        self.__dict__.pop('totals', None)
+
+
+def get_cart_summary(request):
+    summary = getattr(request, 'cart_summary', None)
+    if summary is None:
+        summary = request.cart_summary = CartSummary(request)
+    return summary
 
 
 class CartMiddleware(MiddlewareMixin):
     def process_request(self, request):
-        if not request.session.session_key:
-            request.session.create()
+        if request.path.startswith(tuple(settings.CART_EXCLUDED_PATHS)):
+            return None
 
-        request.cart, created = Cart.objects.get_or_create(
-            session_key=request.session.session_key
-        )
+        request.cart = SimpleLazyObject(lambda: resolve_cart(request))
+        request.cart_summary = CartSummary(request)
         return None
-    
\ No newline at end of file
@@ -1,14 +1,70 @@
-from django.db import models
+from django.conf import settings
+from django.db import connection, models, transaction
+from django.db.models import DecimalField, F, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 from django.contrib.sessions.models import Session
 from main.models import Product, ProductSize
 from decimal import Decimal
 
 
+class CartItemQuerySet(models.QuerySet):
+    def summary(self):
+        money = DecimalField(max_digits=12, decimal_places=2)
+        return self.aggregate(
+            total_items=Coalesce(Sum('quantity'), 0),
+            subtotal=Coalesce(
+                Sum(F('quantity') * F('product__price'), output_field=money),
+                Value(Decimal('0')),
+                output_field=money,
+            ),
+        )
+
+
+class CartQuerySet(models.QuerySet):
+    def actual_totals(self):
+        items = CartItem.objects.filter(cart=OuterRef('pk')).order_by() \
+            .values('cart')
+        money = DecimalField(max_digits=12, decimal_places=2)
+        item_count = items.annotate(total=Sum('quantity')).values('total')
+        subtotal = items.annotate(
+            total=Sum(F('quantity') * F('product__price'), output_field=money)
+        ).values('total')
+        return {
+            'item_count': Coalesce(Subquery(item_count), 0),
+            'subtotal': Coalesce(Subquery(subtotal, output_field=money),
+                                 Value(Decimal('0')), output_field=money),
+        }
+
+
+    def drifted(self):
+        totals = self.actual_totals()
+        return self.annotate(
+            actual_item_count=totals['item_count'],
+            actual_subtotal=totals['subtotal'],
+        ).exclude(
+            item_count=F('actual_item_count'),
+            subtotal=F('actual_subtotal'),
+        )
+
+
+    def repair_totals(self):
+        return self.update(**self.actual_totals())
+
+
 class Cart(models.Model):
     session_key = models.CharField(max_length=40, unique=True)
+    user = models.OneToOneField(settings.AUTH_USER_MODEL, null=True,
+                                blank=True, on_delete=models.CASCADE,
+                                related_name='cart')
+    item_count = models.PositiveIntegerField(default=0)
+    subtotal = models.DecimalField(max_digits=12, decimal_places=2,
+                                   default=Decimal('0'))
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    objects = CartQuerySet.as_manager()
+
 
     def __str__(self):
         return f"Cart {self.session_key}"
@@ -16,12 +72,25 @@ class Cart(models.Model):
 
     @property
     def total_items(self):
-        return sum(item.quantity for item in self.items.all())
+        return self.item_count
 
 
-    @property
-    def subtotal(self):
-        return sum(item.total_price for item in self.items.all())
+    def get_items(self):
+        if self.pk is None:
+            return CartItem.objects.none()
+        return self.items.select_related(
+            'product',
+            'product_size__size',
+        ).order_by('-added_at')
+
+
+    def adjust_totals(self, quantity, amount):
+        Cart.objects.filter(pk=self.pk).update(
+            item_count=F('item_count') + quantity,
+            subtotal=F('subtotal') + amount,
+            updated_at=timezone.now(),
+        )
+        self.refresh_from_db(fields=['item_count', 'subtotal', 'updated_at'])
 
 
     def add_product(self, product, product_size, quantity=1):
@@ -33,36 +102,89 @@ class Cart(models.Model):
         )
 
         if not created:
+            CartItem.objects.filter(pk=cart_item.pk).update(
+                quantity=F('quantity') + quantity
+            )
             cart_item.quantity += quantity
-            cart_item.save()
 
+        self.adjust_totals(quantity, product.price * quantity)
         return cart_item
 
 
-    def remove_item(self, item_id):
-        try:
-            item = self.items.get(id=item_id)
+    def set_item_quantity(self, item, quantity):
+        if quantity > 0:
+            delta = quantity - item.quantity
+            item.quantity = quantity
+            item.save(update_fields=['quantity'])
+        else:
+            delta = -item.quantity
             item.delete()
-            return True
-        except CartItem.DoesNotExist:
-            return False
+
+        if delta:
+            self.adjust_totals(delta, item.product.price * delta)
+
+
+    def remove_item(self, item_id):
+        return self.update_item_quantity(item_id, 0)
 
 
     def update_item_quantity(self, item_id, quantity):
-        try:
-            item = self.items.get(id=item_id)
-            if quantity > 0:
-                item.quantity = quantity
-                item.save()
-            else:
-                item.delete()
-            return True
-        except CartItem.DoesNotExist:
+        if self.pk is None:
             return False
+        with transaction.atomic():
+            # Locked so the change in totals is worked out from the quantity
+            # that is actually replaced.
+            try:
+                item = self.items.select_for_update(of=('self',)) \
+                    .select_related('product').get(id=item_id)
+            except CartItem.DoesNotExist:
+                return False
+            self.set_item_quantity(item, quantity)
+        return True
+
+
+    def merge_from(self, other):
+        """Move every line of `other` into this cart with one upsert.
+
+        Lines for the same size are added together, and quantities are
+        clamped to the stock of their size. `other` is deleted afterwards.
+        """
+        items = CartItem._meta.db_table
+        sizes = ProductSize._meta.db_table
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                INSERT INTO {items} (cart_id, product_id, product_size_id,
+                                     quantity, added_at)
+                SELECT %s, item.product_id, item.product_size_id,
+                       LEAST(item.quantity, size.stock), item.added_at
+                FROM {items} item
+                JOIN {sizes} size ON size.id = item.product_size_id
+                WHERE item.cart_id = %s AND size.stock > 0
+                ON CONFLICT (cart_id, product_id, product_size_id) DO UPDATE
+                SET quantity = LEAST(
+                    {items}.quantity + EXCLUDED.quantity,
+                    (SELECT stock FROM {sizes}
+                     WHERE id = EXCLUDED.product_size_id)
+                )
+            ''', [self.pk, other.pk])
+
+        other.delete()
+        Cart.objects.filter(pk=self.pk).repair_totals()
+        self.refresh_from_db(fields=['item_count', 'subtotal'])
 
 
     def clear(self):
+        if self.pk is None:
+            return
         self.items.all().delete()
+        self.item_count = 0
+        self.subtotal = Decimal('0')
+        self.updated_at = timezone.now()
+        Cart.objects.filter(pk=self.pk).update(
+            item_count=self.item_count,
+            subtotal=self.subtotal,
+            updated_at=self.updated_at,
+        )
 
 
 class CartItem(models.Model):
@@ -72,6 +194,8 @@ class CartItem(models.Model):
     quantity = models.PositiveIntegerField(default=1)
     added_at = models.DateTimeField(auto_now_add=True)
 
+    objects = CartItemQuerySet.as_manager()
+
 
     class Meta:
         unique_together = ('cart', 'product', 'product_size')
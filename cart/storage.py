@@ -0,0 +1,207 @@
+import time
+from decimal import Decimal
+from functools import lru_cache
+
+from django.conf import settings
+from django.core.cache import caches
+from django.db import transaction
+from django.utils.module_loading import import_string
+
+from main.models import ProductSize
+from .models import Cart
+
+
+class CartLocked(Exception):
+    pass
+
+
+class DatabaseCartStorage:
+    """Write every change straight to ``Cart``/``CartItem``."""
+
+    def add_product(self, cart, product, product_size, quantity):
+        cart.add_product(product, product_size, quantity)
+
+
+    def pending(self, session_key):
+        return {}
+
+
+    def pending_totals(self, session_key):
+        return 0, Decimal('0')
+
+
+    def flush(self, session_key):
+        return 0
+
+
+    def flush_dirty(self, batch_size=500):
+        return 0, 0
+
+
+class CacheCartStorage:
+    """Keep additions in the cache and write them to the database later.
+
+    Each session's pending lines live under one cache key guarded by a
+    short ``cache.add`` lock. Sessions are appended to a journal when their
+    first pending line appears; ``flush_dirty`` walks that journal in
+    batches. Anything that reads the cart contents calls ``flush`` first,
+    so checkout always sees every add that completed before it started.
+    """
+
+    prefix = 'cart-storage'
+    lock_timeout = 10
+    lock_wait = 0.2
+
+
+    def __init__(self, alias=None):
+        self.cache = caches[alias or settings.CART_STORAGE_CACHE]
+
+
+    def key(self, *parts):
+        return ':'.join((self.prefix,) + tuple(str(part) for part in parts))
+
+
+    def acquire(self, session_key, wait=None):
+        lock_key = self.key('lock', session_key)
+        deadline = time.monotonic() + (self.lock_wait if wait is None else wait)
+        while not self.cache.add(lock_key, 1, self.lock_timeout):
+            if time.monotonic() >= deadline:
+                raise CartLocked(session_key)
+            time.sleep(0.01)
+        return lock_key
+
+
+    def pending(self, session_key):
+        if not session_key:
+            return {}
+        return self.cache.get(self.key('pending', session_key)) or {}
+
+
+    def pending_totals(self, session_key):
+        lines = self.pending(session_key).values()
+        return (
+            sum(line['quantity'] for line in lines),
+            sum((Decimal(line['price']) * line['quantity'] for line in lines),
+                Decimal('0')),
+        )
+
+
+    def add_product(self, cart, product, product_size, quantity):
+        try:
+            lock_key = self.acquire(cart.session_key)
+        except CartLocked:
+            # A flush holds the cart; writing through keeps the add.
+            cart.add_product(product, product_size, quantity)
+            return
+
+        try:
+            lines = self.pending(cart.session_key)
+            first = not lines
+            line = lines.setdefault(str(product_size.pk), {
+                'product': product.pk,
+                'quantity': 0,
+                'price': str(product.price),
+            })
+            line['quantity'] += quantity
+            self.cache.set(self.key('pending', cart.session_key), lines,
+                           settings.SESSION_COOKIE_AGE)
+        finally:
+            self.cache.delete(lock_key)
+
+        if first:
+            self.mark_dirty(cart.session_key)
+
+
+    def mark_dirty(self, session_key):
+        seq_key = self.key('dirty', 'seq')
+        self.cache.add(seq_key, 0, None)
+        position = self.cache.incr(seq_key)
+        self.cache.set(self.key('dirty', position), session_key,
+                       settings.SESSION_COOKIE_AGE)
+
+
+    def flush(self, session_key, wait=None):
+        if not session_key:
+            return 0
+        lock_key = self.acquire(session_key, wait=self.lock_timeout
+                                if wait is None else wait)
+        pending_key = self.key('pending', session_key)
+
+        lines = self.cache.get(pending_key)
+        if not lines:
+            self.cache.delete(lock_key)
+            return 0
+
+        def release():
+            self.cache.delete_many([pending_key, lock_key])
+
+        try:
+            with transaction.atomic():
+                self.apply(session_key, lines)
+                # Inside a request transaction the lines must stay pending
+                # until the outer commit; the lock keeps adds from racing it.
+                transaction.on_commit(release)
+        except Exception:
+            self.cache.delete(lock_key)
+            raise
+        return sum(line['quantity'] for line in lines.values())
+
+
+    def apply(self, session_key, lines):
+        cart, created = Cart.objects.get_or_create(session_key=session_key)
+        sizes = ProductSize.objects.select_related('product') \
+            .in_bulk([int(size_id) for size_id in lines])
+        for size_id, line in lines.items():
+            product_size = sizes.get(int(size_id))
+            if product_size is not None:
+                cart.add_product(product_size.product, product_size,
+                                 line['quantity'])
+
+
+    def flush_dirty(self, batch_size=500):
+        seq_key = self.key('dirty', 'seq')
+        flushed_key = self.key('dirty', 'flushed')
+        gap_key = self.key('dirty', 'gap')
+
+        start = (self.cache.get(flushed_key) or 0) + 1
+        end = min(self.cache.get(seq_key) or 0, start + batch_size - 1)
+        if end < start:
+            return 0, 0
+
+        positions = range(start, end + 1)
+        keys = [self.key('dirty', position) for position in positions]
+        journal = self.cache.get_many(keys)
+
+        session_keys = []
+        last = start - 1
+        for position, key in zip(positions, keys):
+            session_key = journal.get(key)
+            if session_key is None:
+                # The entry is still being written, or it expired. Wait one
+                # pass for the former before skipping it.
+                if self.cache.get(gap_key) != position:
+                    self.cache.set(gap_key, position, None)
+                    break
+            elif session_key not in session_keys:
+                session_keys.append(session_key)
+            last = position
+
+        flushed = 0
+        for session_key in session_keys:
+            try:
+                flushed += self.flush(session_key, wait=0)
+            except CartLocked:
+                self.mark_dirty(session_key)
+
+        self.cache.set(flushed_key, last, None)
+        self.cache.delete_many(keys[:last - start + 1])
+        return last - start + 1, flushed
+
+
+@lru_cache(maxsize=None)
+def load_cart_storage(path):
+    return import_string(path)()
+
+
+def get_cart_storage():
+    return load_cart_storage(settings.CART_STORAGE)
@@ -1,5 +1,4 @@
 from django import template
-from cart.models import Cart
 
 
 register = template.Library()
@@ -7,15 +6,10 @@ register = template.Library()
 
 @register.simple_tag(takes_context=True)
 def get_cart_count(context):
-    request = context['request']
-    if not request.session.session_key:
-        return 0
-
-    try:
-        cart = Cart.objects.get(session_key=request.session.session_key)
-        return cart.total_items
-    except Cart.DoesNotExist:
+    summary = getattr(context['request'], 'cart_summary', None)
+    if summary is None:
         return 0
+    return summary.total_items
 
 
 @register.filter
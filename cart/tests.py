@@ -1,3 +1,152 @@
-from django.test import TestCase
+import threading
+from concurrent.futures import ThreadPoolExecutor
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.contrib.sessions.backends.db import SessionStore
+from django.db import connection
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase
+from django.urls import reverse
+from main.models import Category, Product, ProductSize, Size, StockReservation
+from main.stock import adjust_reservations
+from .middleware import attach_user_cart
+from .models import Cart, CartItem
+
+
+class CartQuantityTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts')
+        cls.product = Product.objects.create(name='Shirt', slug='shirt',
+                                             category=category, color='Blue',
+                                             price='10.00')
+        cls.product_size = ProductSize.objects.create(
+            product=cls.product, size=Size.objects.create(name='M'), stock=5,
+        )
+
+
+    def setUp(self):
+        self.client.post(reverse('cart:add_to_cart', args=[self.product.slug]),
+                         {'size_id': self.product_size.pk, 'quantity': 2})
+        self.item = CartItem.objects.get()
+
+
+    def assertHeld(self, quantity):
+        self.product_size.refresh_from_db()
+        self.assertEqual(self.product_size.reserved, quantity)
+        self.assertEqual(sum(StockReservation.objects
+                             .values_list('quantity', flat=True)), quantity)
+
+
+    def test_update_reserves_and_releases_the_difference(self):
+        url = reverse('cart:update_item', args=[self.item.pk])
+        self.client.post(url, {'quantity': 4})
+        self.assertHeld(4)
+
+        self.client.post(url, {'quantity': 1})
+        self.assertHeld(1)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 1)
+
+
+    def test_update_beyond_unreserved_stock_changes_nothing(self):
+        ProductSize.objects.filter(pk=self.product_size.pk).update(reserved=4)
+        response = self.client.post(reverse('cart:update_item', args=[self.item.pk]),
+                                    {'quantity': 4})
+
+        self.assertEqual(response.status_code, 400)
+        self.item.refresh_from_db()
+        self.assertEqual(self.item.quantity, 2)
+
+
+    def test_batch_update(self):
+        self.client.post(reverse('cart:batch_update'),
+                         {f'item-{self.item.pk}': 3})
+        self.assertHeld(3)
+
+        self.client.post(reverse('cart:batch_update'),
+                         {f'item-{self.item.pk}': 0})
+        self.assertHeld(0)
+        self.assertFalse(CartItem.objects.exists())
+
+
+class LoginMergeTests(TestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shirts')
+        self.product = Product.objects.create(name='Shirt', slug='shirt',
+                                              category=category, color='Blue',
+                                              price='10.00')
+        self.product_size = ProductSize.objects.create(
+            product=self.product, size=Size.objects.create(name='M'), stock=10,
+        )
+        self.user = get_user_model()(email='merge@example.com')
+        self.user.set_password('secret-password')
+        self.user.save()
+
+
+    def test_holds_follow_quantities_clamped_by_the_merge(self):
+        user_cart = Cart.objects.create(user=self.user, session_key='other-device')
+        CartItem.objects.create(cart=user_cart, product=self.product,
+                                product_size=self.product_size, quantity=3)
+        adjust_reservations('other-device', {self.product_size.pk: 3})
+        self.client.post(reverse('cart:add_to_cart', args=[self.product.slug]),
+                         {'size_id': self.product_size.pk, 'quantity': 4})
+        ProductSize.objects.filter(pk=self.product_size.pk).update(stock=5)
+
+        request = RequestFactory().post('/')
+        request.session = SessionStore()
+        request.user = self.user
+        attach_user_cart(request, self.client.session.session_key)
+
+        self.assertEqual(CartItem.objects.get(cart__user=self.user).quantity, 5)
+        self.product_size.refresh_from_db()
+        self.assertEqual(self.product_size.reserved, 5)
+        self.assertEqual(StockReservation.objects.get().quantity, 5)
+
+
+    def test_session_invalidated_by_a_password_change_loses_the_cart(self):
+        Cart.objects.create(user=self.user, session_key='other-device')
+        self.client.force_login(self.user)
+        self.user.set_password('changed-password')
+        self.user.save()
+
+        self.client.post(reverse('cart:add_to_cart', args=[self.product.slug]),
+                         {'size_id': self.product_size.pk, 'quantity': 1})
+
+        self.assertFalse(CartItem.objects.filter(cart__user=self.user).exists())
+
+
+class ConcurrentUpdateTests(TransactionTestCase):
+    def setUp(self):
+        category = Category.objects.create(name='Shirts')
+        product = Product.objects.create(name='Shirt', slug='shirt',
+                                         category=category, color='Blue',
+                                         price='10.00')
+        self.product_size = ProductSize.objects.create(
+            product=product, size=Size.objects.create(name='M'), stock=20,
+        )
+        self.client.post(reverse('cart:add_to_cart', args=[product.slug]),
+                         {'size_id': self.product_size.pk, 'quantity': 1})
+        self.item = CartItem.objects.get()
+
+
+    def test_parallel_updates_reserve_the_final_quantity(self):
+        quantities = [2, 5, 3, 8, 4, 6, 7, 9]
+        start = threading.Barrier(len(quantities))
+        url = reverse('cart:update_item', args=[self.item.pk])
+
+        def update(quantity):
+            client = Client()
+            client.cookies = self.client.cookies
+            start.wait()
+            try:
+                return client.post(url, {'quantity': quantity}).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=len(quantities)) as pool:
+            self.assertEqual(set(pool.map(update, quantities)), {200})
+
+        self.item.refresh_from_db()
+        self.product_size.refresh_from_db()
+        self.assertEqual(self.product_size.reserved, self.item.quantity)
+        self.assertEqual(StockReservation.objects.get().quantity, self.item.quantity)
@@ -4,27 +4,55 @@ from django.http import JsonResponse, HttpResponse
 from django.template.response import TemplateResponse
 from django.contrib import messages
 from django.db import transaction
+from django.db.models import F, Q
+from django.utils.decorators import method_decorator
 from main.models import Product, ProductSize
+from main.stock import adjust_reservations, release_session, release_stock, \
+    reserve_stock
 from .models import Cart, CartItem
 from .forms import AddToCartForm
+from .middleware import get_cart_summary, get_or_create_cart, resolve_cart, \
+    session_user_id
+from .storage import get_cart_storage
+from decimal import Decimal
 import json
 
 
 class CartMixin:
-    def get_cart(self, request):
-        if hasattr(request, 'cart'):
-            return request.cart
+    def get_cart(self, request, create=False, flush=True):
+        cart = getattr(request, 'cart', None)
+        if cart is None:
+            cart = resolve_cart(request)
+
+        # Views that read the cart contents see every buffered addition.
+        if flush and cart.pk is not None \
+                and get_cart_storage().flush(cart.session_key):
+            cart.refresh_from_db(fields=['item_count', 'subtotal'])
+            get_cart_summary(request).refresh()
+
+        # A signed-in user's unlinked session cart is claimed on first write.
+        if create and (cart.pk is None
+                       or cart.user_id is None and session_user_id(request)):
+            cart = get_or_create_cart(request)
+        return cart
 
-        if not request.session.session_key:
-            request.session.create()
 
-        cart, created = Cart.objects.get_or_create(
-            session_key=request.session.session_key
-        )
+    def render_cart_change(self, request, cart, changed=(), created=(), removed=()):
+        # render=rows answers with the touched rows and the totals as
+        # out-of-band swaps, so the response doesn't grow with the cart.
+        if request.POST.get('render') == 'rows':
+            return TemplateResponse(request, 'cart/cart_rows.html', {
+                'cart': cart,
+                'changed_items': changed,
+                'created_items': created,
+                'removed_ids': removed,
+            })
 
-        request.session['cart_id'] = cart.id
-        request.session.modified = True
-        return cart
+        context = {
+            'cart': cart,
+            'cart_items': cart.get_items()
+        }
+        return TemplateResponse(request, 'cart/cart_modal.html', context)
 
 
 class CartModalView(CartMixin, View):
@@ -32,18 +60,19 @@ class CartModalView(CartMixin, View):
         cart = self.get_cart(request)
         context = {
             'cart': cart,
-            'cart_items': cart.items.select_related(
-                'product',
-                'product_size__size'
-            ).order_by('-added_at')
+            'cart_items': cart.get_items()
         }
         return TemplateResponse(request, 'cart/cart_modal.html', context)
 
 
+# Stock is reserved in its own short transaction so buyers of the same size
+# never wait on each other for the rest of the request. The views that
+# change quantities work the same way.
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class AddToCartView(CartMixin, View):
-    @transaction.atomic
     def post(self, request, slug):
-        cart = self.get_cart(request)
+        cart = self.get_cart(request, create=True, flush=False)
+        storage = get_cart_storage()
         product = get_object_or_404(Product, slug=slug)
 
         form = AddToCartForm(request.POST, product=product)
@@ -62,110 +91,232 @@ class AddToCartView(CartMixin, View):
                 product=product
             )
         else:
-            product_size = product.product_sizes.filter(stock__gt=0).first()
+            product_size = product.product_sizes \
+                .filter(stock__gt=F('reserved')).first()
             if not product_size:
                 return JsonResponse({
                     'error': 'No sizes available'
                 }, status=400)
 
         quantity = form.cleaned_data['quantity']
-        if product_size.stock < quantity:
-            return JsonResponse({
-                'error': f'Only {product_size.stock} items available'
-            }, status=400)
 
         existing_item = cart.items.filter(
             product=product,
             product_size=product_size,
         ).first()
+        pending = storage.pending(cart.session_key).get(str(product_size.pk))
+        in_cart = (existing_item.quantity if existing_item else 0) \
+            + (pending['quantity'] if pending else 0)
 
-        if existing_item:
-            total_quantity = existing_item.quantity + quantity
+        if in_cart:
+            total_quantity = in_cart + quantity
             if total_quantity > product_size.stock:
                 return JsonResponse({
-                    'error': f"Cannot add {quantity} items. Only {product_size.stock - existing_item.quantity} more available."
+                    'error': f"Cannot add {quantity} items. Only {product_size.stock - in_cart} more available."
                 }, status=400)
 
-        cart_item = cart.add_product(product, product_size, quantity)
+        if not reserve_stock(product_size.pk, cart.session_key, quantity):
+            product_size.refresh_from_db(fields=['stock', 'reserved'])
+            return JsonResponse({
+                'error': f'Only {product_size.available} items available'
+            }, status=400)
 
-        request.session['cart_id'] = cart.id
-        request.session.modified = True
+        try:
+            with transaction.atomic():
+                storage.add_product(cart, product, product_size, quantity)
+        except Exception:
+            release_stock(product_size.pk, cart.session_key, quantity)
+            raise
 
         if request.headers.get('HX-Request'):
             return redirect('cart:cart_modal')
         else:
+            get_cart_summary(request).refresh()
             return JsonResponse({
                 'success': True,
-                'total_items': cart.total_items,
+                'total_items': get_cart_summary(request).total_items,
                 'message': f"{product.name} added to cart",
-                'cart_item_id': cart_item.id
             })
 
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class UpdateCartItemView(CartMixin, View):
-    @transaction.atomic
     def post(self, request, item_id):
         cart = self.get_cart(request)
-        cart_item = get_object_or_404(CartItem, id=item_id, cart=cart)
-
         quantity = int(request.POST.get('quantity', 1))
 
         if quantity < 0:
             return JsonResponse({'error': 'Invalid quantity'}, status=400)
 
-        if quantity == 0:
-            cart_item.delete()
-        else:
-            if quantity > cart_item.product_size.stock:
+        with transaction.atomic():
+            # The line stays locked until its new quantity is saved, so two
+            # updates can't both reserve against the same old quantity.
+            cart_item = get_object_or_404(
+                CartItem.objects.select_for_update(of=('self',))
+                .select_related('product', 'product_size__size'),
+                id=item_id,
+                cart_id=cart.pk,
+            )
+
+            if quantity > 0 and quantity > cart_item.product_size.stock:
                 return JsonResponse({
                     'error': f'Only {cart_item.product_size.stock} items available'
                 }, status=400)
 
-            cart_item.quantity = quantity
-            cart_item.save()
+            delta = quantity - cart_item.quantity
+            if delta > 0 and not reserve_stock(cart_item.product_size_id,
+                                               cart.session_key, delta):
+                cart_item.product_size.refresh_from_db(fields=['stock', 'reserved'])
+                return JsonResponse({
+                    'error': f'Only {cart_item.product_size.available} more items available'
+                }, status=400)
 
-        request.session['cart_id'] = cart.id
-        request.session.modified = True
+            item_id = cart_item.id
+            cart.set_item_quantity(cart_item, quantity)
+            if delta < 0:
+                release_stock(cart_item.product_size_id, cart.session_key, -delta)
 
-        context = {
-            'cart': cart,
-            'cart_items': cart.items.select_related(
-                'product',
-                'product_size__size',
-            ).order_by('-added_at')
-        }
-        return TemplateResponse(request, 'cart/cart_modal.html', context)
+        if quantity:
+            return self.render_cart_change(request, cart, changed=[cart_item])
+        return self.render_cart_change(request, cart, removed=[item_id])
 
 
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class RemoveCartItemView(CartMixin, View):
     def post(self, request, item_id):
         cart = self.get_cart(request)
+        with transaction.atomic():
+            cart_item = CartItem.objects.select_for_update(of=('self',)) \
+                .select_related('product') \
+                .filter(id=item_id, cart_id=cart.pk).first()
 
-        try:
-            cart_item = cart.items.get(id=item_id)
-            cart_item.delete()
+            if cart_item is None:
+                return JsonResponse({'error': 'Item not found'}, status=400)
 
-            request.session['cart_id'] = cart.id
-            request.session.modified = True
+            item_id = cart_item.id
+            cart.set_item_quantity(cart_item, 0)
+            release_stock(cart_item.product_size_id, cart.session_key)
 
-            context = {
-                'cart': cart,
-                'cart_items': cart.items.select_related(
-                    'product',
-                    'product_size__size',
-                ).order_by('-added_at')
+        return self.render_cart_change(request, cart, removed=[item_id])
+
+
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
+class BatchUpdateCartView(CartMixin, View):
+    """Apply several quantity changes from the cart modal in one request.
+
+    ``item-<id>=<quantity>`` sets the quantity of a cart line (0 removes it)
+    and ``add-<product size id>=<quantity>`` adds to a size.
+    """
+
+    def post(self, request):
+        try:
+            updates, additions = self.parse_operations(request.POST)
+        except ValueError:
+            return JsonResponse({'error': 'Invalid quantity'}, status=400)
+
+        cart = self.get_cart(request, create=bool(additions))
+        # The lines stay locked until they are saved, so the deltas are
+        # worked out from quantities no other request can change meanwhile.
+        with transaction.atomic():
+            items = list(cart.get_items().select_for_update(of=('self',)).filter(
+                Q(id__in=updates) | Q(product_size_id__in=additions)
+            ))
+            lines = {item.product_size_id: item for item in items}
+            sizes = {item.product_size_id: item.product_size for item in items}
+            missing = set(additions) - set(sizes)
+            if missing:
+                sizes.update(ProductSize.objects.select_related('product', 'size')
+                             .in_bulk(missing))
+
+            quantities = {}
+            for item in items:
+                if item.id in updates:
+                    quantities[item.product_size_id] = updates[item.id]
+            for size_id, quantity in additions.items():
+                if size_id not in sizes:
+                    continue
+                current = lines[size_id].quantity if size_id in lines else 0
+                quantities[size_id] = quantities.get(size_id, current) + quantity
+
+            too_many = [sizes[size_id] for size_id, quantity in quantities.items()
+                        if quantity > sizes[size_id].stock]
+            if too_many:
+                return JsonResponse({'error': '; '.join(
+                    f'Only {size.stock} items of {size.product.name} '
+                    f'({size.size.name}) available' for size in too_many
+                )}, status=400)
+
+            deltas = {
+                size_id: quantity - (lines[size_id].quantity if size_id in lines else 0)
+                for size_id, quantity in quantities.items()
             }
-            return TemplateResponse(request, 'cart/cart_modal.html', context)
-        except CartItem.DoesNotExist:
-            return JsonResponse({'error': 'Item not found'}, status=400)
+            short = adjust_reservations(cart.session_key, deltas)
+            if short:
+                return JsonResponse({'error': '; '.join(
+                    f'Not enough {sizes[size_id].product.name} '
+                    f'({sizes[size_id].size.name}) left'
+                    for size_id in short
+                )}, status=400)
+
+            changed, created, removed = self.apply(cart, lines, sizes, quantities)
+
+        return self.render_cart_change(request, cart, changed, created, removed)
+
+
+    def parse_operations(self, data):
+        updates, additions = {}, {}
+        for key, value in data.items():
+            prefix, _, pk = key.partition('-')
+            if prefix not in ('item', 'add') or not pk.isdigit():
+                continue
+            quantity = int(value)
+            if quantity < 0:
+                raise ValueError(key)
+            if prefix == 'item':
+                updates[int(pk)] = quantity
+            elif quantity:
+                additions[int(pk)] = quantity
+        return updates, additions
+
+
+    def apply(self, cart, lines, sizes, quantities):
+        changed, removed, created = [], [], []
+        count = 0
+        amount = Decimal('0')
+        for size_id, quantity in quantities.items():
+            product_size = sizes[size_id]
+            item = lines.get(size_id)
+            delta = quantity - (item.quantity if item else 0)
+            if not delta:
+                continue
+            count += delta
+            amount += product_size.product.price * delta
+
+            if item is None:
+                created.append(CartItem(cart=cart,
+                                        product=product_size.product,
+                                        product_size=product_size,
+                                        quantity=quantity))
+            elif quantity:
+                item.quantity = quantity
+                changed.append(item)
+            else:
+                removed.append(item.id)
+
+        CartItem.objects.bulk_update(changed, ['quantity'])
+        CartItem.objects.bulk_create(created)
+        CartItem.objects.filter(id__in=removed).delete()
+        if count or amount:
+            cart.adjust_totals(count, amount)
+        return changed, created, removed
 
 
 class CartCountView(CartMixin, View):
     def get(self, request):
-        cart = self.get_cart(request)
+        summary = get_cart_summary(request)
         return JsonResponse({
-            'total_items': cart.total_items,
-            'subtotal': float(cart.subtotal)
+            'total_items': summary.total_items,
+            'subtotal': float(summary.subtotal)
         })
 
 
@@ -173,9 +324,7 @@ class ClearCartView(CartMixin, View):
     def post(self, request):
         cart = self.get_cart(request)
         cart.clear()
-
-        request.session['cart_id'] = cart.id
-        request.session.modified = True
+        release_session(cart.session_key)
 
         if request.headers.get('HX-Request'):
             return TemplateResponse(request, 'cart/cart_empty.html', {
@@ -192,9 +341,6 @@ class CartSummaryView(CartMixin, View):
         cart = self.get_cart(request)
         context = {
             'cart': cart,
-            'cart_items': cart.items.select_related(
-                'product',
-                'product_size__size'
-            ).order_by('-added_at')
+            'cart_items': cart.get_items()
         }
         return TemplateResponse(request, 'cart/cart_summary.html', context)
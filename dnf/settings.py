@@ -41,6 +41,7 @@ INSTALLED_APPS = [
     'django.contrib.sessions',
     'django.contrib.messages',
     'django.contrib.staticfiles',
+    'django.contrib.postgres',
 
     'main',
     'cart',
@@ -52,6 +53,7 @@ INSTALLED_APPS = [
 MIDDLEWARE = [
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
+    'users.middleware.SessionRefreshMiddleware',
     'django.middleware.common.CommonMiddleware',
     'django.middleware.csrf.CsrfViewMiddleware',
     'django.contrib.auth.middleware.AuthenticationMiddleware',
@@ -99,6 +101,25 @@ DATABASES = {
 }
 
 
+# Cache
+# https://docs.djangoproject.com/en/5.2/topics/cache/
+# Point this at a shared backend (Redis, Memcached) in production so that
+# cache invalidation reaches every worker; `check --deploy` refuses a
+# per-process one.
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND',
+                             'django.core.cache.backends.locmem.LocMemCache'),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+# Bearer token a metrics scraper sends to read /metrics/fragment-cache/.
+# Staff users can read it without one.
+METRICS_TOKEN = os.getenv('METRICS_TOKEN', '')
+
+
 # Password validation
 # https://docs.djangoproject.com/en/5.2/ref/settings/#auth-password-validators
 
@@ -139,6 +160,9 @@ STATIC_ROOT = os.path.join(BASE_DIR, 'static')
 MEDIA_URL = '/media/'
 MEDIA_ROOT = os.path.join(BASE_DIR, 'media')
 
+# Threads per process that build resized copies of uploaded product images.
+IMAGE_DERIVATIVE_WORKERS = int(os.getenv('IMAGE_DERIVATIVE_WORKERS', '2'))
+
 # Default primary key field type
 # https://docs.djangoproject.com/en/5.2/ref/settings/#default-auto-field
 
@@ -146,7 +170,36 @@ DEFAULT_AUTO_FIELD = 'django.db.models.BigAutoField'
 
 
 SESSION_COOKIE_AGE = 86400 ## через 30 дней удалится
-SESSION_SAVE_EVERY_REQUEST = True
+# cached_db needs a cache shared by every worker; signed_cookies keeps
+# sessions out of the database entirely.
+SESSION_ENGINE = os.getenv('SESSION_ENGINE', 'django.contrib.sessions.backends.db')
+SESSION_SAVE_EVERY_REQUEST = False
+# Unchanged sessions are only saved again once less than this many seconds
+# of their lifetime are left.
+SESSION_REFRESH_THRESHOLD = int(os.getenv('SESSION_REFRESH_THRESHOLD',
+                                          str(SESSION_COOKIE_AGE // 2)))
+
+# Requests under these prefixes never resolve a cart.
+CART_EXCLUDED_PATHS = [
+    '/admin/',
+    '/payment/stripe/webhook',
+    f"/{STATIC_URL.lstrip('/')}",
+    MEDIA_URL,
+]
+
+# Where cart additions are written first. CacheCartStorage buffers them in
+# CART_STORAGE_CACHE and writes them through with `manage.py flush_cart_storage`,
+# so that cache has to be shared by every process (not LocMemCache).
+CART_STORAGE = os.getenv('CART_STORAGE', 'cart.storage.DatabaseCartStorage')
+CART_STORAGE_CACHE = os.getenv('CART_STORAGE_CACHE', 'default')
+
+# Seconds a cart holds the stock it added before `manage.py
+# release_expired_reservations` hands it back.
+STOCK_RESERVATION_TTL = int(os.getenv('STOCK_RESERVATION_TTL', '900'))
+
+# Seconds a submitted checkout form key is remembered, so repeating the
+# submit replays the first response instead of placing another order.
+CHECKOUT_IDEMPOTENCY_TTL = int(os.getenv('CHECKOUT_IDEMPOTENCY_TTL', '86400'))
 
 AUTH_USER_MODEL = 'users.CustomUser'
 
@@ -0,0 +1,137 @@
+import hashlib
+import uuid
+from urllib.parse import urlencode
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+class VersionedCache:
+    """Keep a reference list in process memory and reload it only when the
+    version stored in the shared cache changes.
+
+    Each lookup costs a single cache read for the version key, so every
+    worker drops its copy as soon as any process calls ``invalidate``.
+    """
+
+    def __init__(self, name, loader):
+        self.version_key = f'reference_version:{name}'
+        self.loader = loader
+        self._local = (None, None)
+
+
+    def version(self):
+        version = cache.get(self.version_key)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(self.version_key, version, None):
+                version = cache.get(self.version_key)
+        return version
+
+
+    def get(self):
+        version = self.version()
+        local_version, value = self._local
+        if local_version != version or value is None:
+            value = self.loader()
+            self._local = (version, value)
+        return value
+
+
+    def invalidate(self):
+        # Bump only after commit so that no worker reloads the old rows under
+        # the new version.
+        transaction.on_commit(
+            lambda: cache.set(self.version_key, uuid.uuid4().hex, None)
+        )
+
+
+def load_categories():
+    from .models import Category
+    return list(Category.objects.all())
+
+
+categories_cache = VersionedCache('categories', load_categories)
+
+
+class FragmentCache:
+    """Rendered HTMX fragments grouped into scopes that are invalidated as a
+    whole, e.g. everything rendered for one category.
+    """
+
+    timeout = 300
+
+    def __init__(self, name):
+        self.name = name
+
+
+    def version_key(self, scope):
+        return f'fragment_version:{self.name}:{scope}'
+
+
+    def version(self, scope):
+        version_key = self.version_key(scope)
+        version = cache.get(version_key)
+        if version is None:
+            version = uuid.uuid4().hex
+            if not cache.add(version_key, version, None):
+                version = cache.get(version_key)
+        return version
+
+
+    def fragment_key(self, scope, template_name, params):
+        digest = hashlib.md5(
+            f'{template_name}?{urlencode(sorted(params.items()))}'.encode()
+        ).hexdigest()
+        return f'fragment:{self.name}:{scope}:{digest}'
+
+
+    def get(self, scope, template_name, params):
+        """Return ``(content, version)``; content is None on a miss."""
+        version_key = self.version_key(scope)
+        fragment_key = self.fragment_key(scope, template_name, params)
+        values = cache.get_many([version_key, fragment_key])
+
+        version = values.get(version_key) or self.version(scope)
+
+        cached_version, content = values.get(fragment_key, (None, None))
+        if cached_version == version:
+            self.count('hits')
+            return content, version
+        self.count('misses')
+        return None, version
+
+
+    def set(self, scope, template_name, params, content, version):
+        cache.set(self.fragment_key(scope, template_name, params),
+                  (version, content), self.timeout)
+
+
+    def invalidate(self, *scopes):
+        keys = {self.version_key(scope): uuid.uuid4().hex
+                for scope in set(filter(None, scopes))}
+        transaction.on_commit(lambda: cache.set_many(keys, None))
+
+
+    def count(self, outcome):
+        key = f'fragment_stats:{self.name}:{outcome}'
+        if not cache.add(key, 1, None):
+            cache.incr(key)
+
+
+    def stats(self):
+        keys = {outcome: f'fragment_stats:{self.name}:{outcome}'
+                for outcome in ('hits', 'misses')}
+        values = cache.get_many(keys.values())
+        return {outcome: values.get(key, 0) for outcome, key in keys.items()}
+
+
+catalog_fragments = FragmentCache('catalog')
+
+
+def invalidate_category_fragments(*category_ids):
+    slugs = {category.id: category.slug
+             for category in categories_cache.get()}
+    catalog_fragments.invalidate(
+        'all', *[slugs.get(category_id) for category_id in category_ids]
+    )
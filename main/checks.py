@@ -0,0 +1,27 @@
+from django.conf import settings
+from django.core.checks import Error, register
+
+
+# These keep their data inside the process, so every worker would hold
+# cache entries and versions of its own.
+PER_PROCESS_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+# A single development server is fine with a local cache, so this only runs
+# with `manage.py check --deploy`.
+@register(deploy=True)
+def check_versioned_cache(app_configs, **kwargs):
+    backend = settings.CACHES.get('default', {}).get('BACKEND')
+    if backend not in PER_PROCESS_CACHES:
+        return []
+    return [Error(
+        f'The category list and catalog fragments are versioned in the '
+        f'default cache ({backend}), so a change only reaches the worker '
+        f'that made it.',
+        hint='Set CACHE_BACKEND and CACHE_LOCATION to a cache shared by '
+             'every worker, such as Redis or Memcached.',
+        id='main.E001',
+    )]
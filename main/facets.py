@@ -0,0 +1,107 @@
+from decimal import Decimal
+
+from django.db import transaction
+from django.db.models import Case, CharField, Count, Min, Q, Sum, Value, When
+from django.db.models.functions import Lower
+
+from .models import Category, CategoryFacet, Product, ProductSize
+
+
+PRICE_BUCKETS = (
+    ('0-50', Decimal('0'), Decimal('49.99')),
+    ('50-100', Decimal('50'), Decimal('99.99')),
+    ('100-250', Decimal('100'), Decimal('249.99')),
+    ('250-500', Decimal('250'), Decimal('499.99')),
+    ('500+', Decimal('500'), None),
+)
+
+
+def price_bucket():
+    return Case(
+        *[When(price__lte=high, then=Value(key))
+          for key, low, high in PRICE_BUCKETS if high is not None],
+        default=Value(PRICE_BUCKETS[-1][0]),
+        output_field=CharField(),
+    )
+
+
+def count_facets(category_id):
+    products = Product.objects.filter(category_id=category_id).order_by()
+    facets = []
+
+    colors = products.annotate(value=Lower('color')).values('value') \
+        .annotate(count=Count('id'))
+    for row in colors:
+        facets.append(CategoryFacet(facet='color', value=row['value'],
+                                    count=row['count']))
+
+    sizes = ProductSize.objects.filter(
+        product__category_id=category_id, stock__gt=0
+    ).values('size__name').annotate(
+        count=Count('product', distinct=True), position=Min('size_id')
+    ).order_by()
+    for row in sizes:
+        facets.append(CategoryFacet(facet='size', value=row['size__name'],
+                                    position=row['position'],
+                                    count=row['count']))
+
+    buckets = products.annotate(value=price_bucket()).values('value') \
+        .annotate(count=Count('id'))
+    positions = {key: position for position, (key, low, high)
+                 in enumerate(PRICE_BUCKETS)}
+    for row in buckets:
+        facets.append(CategoryFacet(facet='price', value=row['value'],
+                                    position=positions[row['value']],
+                                    count=row['count']))
+
+    for facet in facets:
+        facet.category_id = category_id
+    return facets
+
+
+def refresh_category_facets(*category_ids):
+    """Recount the facets of the given categories from their own rows only.
+
+    Recounts of one category queue on its row, so concurrent saves never
+    interleave. Counts are upserted and only the values that are gone are
+    deleted.
+    """
+    for category_id in sorted(set(filter(None, category_ids))):
+        with transaction.atomic():
+            if not list(Category.objects.select_for_update()
+                        .filter(pk=category_id).values_list('pk')):
+                continue
+            facets = count_facets(category_id)
+            CategoryFacet.objects.bulk_create(
+                facets,
+                update_conflicts=True,
+                unique_fields=['category', 'facet', 'value'],
+                update_fields=['position', 'count'],
+            )
+            current = Q()
+            for facet in facets:
+                current |= Q(facet=facet.facet, value=facet.value)
+            CategoryFacet.objects.filter(category_id=category_id) \
+                .exclude(current).delete()
+
+
+def get_facets(category=None):
+    if category is not None:
+        rows = CategoryFacet.objects.filter(category=category) \
+            .values_list('facet', 'value', 'count')
+    else:
+        rows = CategoryFacet.objects.values('facet', 'value', 'position') \
+            .annotate(total=Sum('count')) \
+            .values_list('facet', 'value', 'total')
+
+    facets = {'color': [], 'size': [], 'price': []}
+    for facet, value, count in rows.order_by('facet', 'position', 'value'):
+        facets[facet].append({'value': value, 'count': count})
+
+    bounds = {key: (low, high) for key, low, high in PRICE_BUCKETS}
+    facets['price'] = [
+        dict(bucket, min_price=bounds[bucket['value']][0],
+             max_price=bounds[bucket['value']][1])
+        for bucket in facets['price'] if bucket['value'] in bounds
+    ]
+    return facets
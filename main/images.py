@@ -0,0 +1,86 @@
+import io
+import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.db import connections, transaction
+from PIL import Image, ImageOps
+
+
+logger = logging.getLogger(__name__)
+
+DERIVATIVE_WIDTHS = (300, 600, 1200)
+DERIVATIVE_FORMATS = (
+    ('webp', 'WEBP'),
+    ('jpg', 'JPEG'),
+)
+
+_executor = ThreadPoolExecutor(
+    max_workers=settings.IMAGE_DERIVATIVE_WORKERS,
+    thread_name_prefix='image-derivatives',
+)
+
+
+def derivative_name(name, width, extension):
+    root, _ = os.path.splitext(name)
+    return f'{root}_w{width}.{extension}'
+
+
+def generate_derivatives(field_file):
+    """Write resized copies of `field_file` next to it and return the widths
+    that were generated. Widths larger than the original are skipped, so an
+    image narrower than all of them gets an empty list.
+    """
+    storage = field_file.storage
+    with storage.open(field_file.name, 'rb') as original:
+        image = ImageOps.exif_transpose(Image.open(original))
+        image.load()
+
+    widths = [width for width in DERIVATIVE_WIDTHS if width < image.width]
+    for width in widths:
+        height = round(image.height * width / image.width)
+        resized = image.resize((width, height), Image.LANCZOS)
+        for extension, image_format in DERIVATIVE_FORMATS:
+            output = resized
+            if image_format == 'JPEG' and output.mode != 'RGB':
+                output = output.convert('RGB')
+            buffer = io.BytesIO()
+            output.save(buffer, image_format, quality=82)
+            name = derivative_name(field_file.name, width, extension)
+            if storage.exists(name):
+                storage.delete(name)
+            storage.save(name, ContentFile(buffer.getvalue()))
+    return widths
+
+
+def build_derivatives(model, pk, field_name, derivatives_field):
+    from .cache import invalidate_category_fragments
+
+    try:
+        instance = model.objects.filter(pk=pk).first()
+        field_file = getattr(instance, field_name, None)
+        if not field_file:
+            return
+
+        widths = generate_derivatives(field_file)
+        # Only record the widths if the image was not replaced meanwhile.
+        updated = model.objects.filter(
+            pk=pk, **{field_name: field_file.name}
+        ).update(**{derivatives_field: widths})
+        if updated:
+            product = getattr(instance, 'product', instance)
+            invalidate_category_fragments(product.category_id)
+    except Exception:
+        logger.exception('Could not build derivatives for %s %s',
+                         model.__name__, pk)
+    finally:
+        connections.close_all()
+
+
+def schedule_derivatives(instance, field_name, derivatives_field):
+    transaction.on_commit(lambda: _executor.submit(
+        build_derivatives, type(instance), instance.pk,
+        field_name, derivatives_field,
+    ))
@@ -0,0 +1,99 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import connection
+from django.db.models import Q
+from main.management.rollback import rolled_back
+from main.models import Category, Product
+
+
+WORDS = ['black', 'white', 'denim', 'leather', 'hoodie', 'jacket',
+         'shirt', 'cotton', 'wool', 'vintage', 'oversized', 'cropped',
+         'distressed', 'printed', 'knit', 'trousers', 'boots', 'cap']
+
+
+class Command(BaseCommand):
+    help = 'Compare icontains and full-text catalog search latency'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[10_000, 100_000, 1_000_000])
+        parser.add_argument('--queries', nargs='+',
+                            default=['hoodie', 'black leather', 'vint'])
+        parser.add_argument('--repeat', type=int, default=20)
+        parser.add_argument('--batch-size', type=int, default=10_000)
+
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            self.stderr.write('The search benchmark needs PostgreSQL')
+            return
+
+        # Everything runs in one transaction that is rolled back at the end,
+        # so the synthetic products never reach the real catalog.
+        with rolled_back():
+            category = Category.objects.create(
+                name='Benchmark', slug='benchmark-search'
+            )
+            created = 0
+            for size in sorted(options['sizes']):
+                created = self.seed(category, created, size,
+                                    options['batch_size'])
+                self.report(size, options['queries'], options['repeat'])
+
+
+    def seed(self, category, start, end, batch_size):
+        for offset in range(start, end, batch_size):
+            Product.objects.bulk_create([
+                Product(
+                    name=self.words(i, 3),
+                    slug=f'benchmark-search-{i}',
+                    category=category,
+                    color=WORDS[i % 4],
+                    price=10 + i % 500,
+                    description=self.words(i * 7, 12),
+                    main_image='products/main/benchmark.jpg',
+                )
+                for i in range(offset, min(offset + batch_size, end))
+            ])
+        Product.objects.filter(
+            category=category, search_vector__isnull=True
+        ).update_search_vector()
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE main_product')
+        return end
+
+
+    def words(self, seed, count):
+        return ' '.join(
+            WORDS[(seed * 31 + n * 17) % len(WORDS)] for n in range(count)
+        )
+
+
+    def report(self, size, queries, repeat):
+        self.stdout.write(f'{size} products')
+        for query in queries:
+            legacy = self.measure(repeat, lambda: Product.objects.filter(
+                Q(name__icontains=query) | Q(description__icontains=query)
+            ).order_by('-created_at')[:24])
+            fts = self.measure(
+                repeat, lambda: Product.objects.search(query)[:24]
+            )
+            self.stdout.write(
+                f'  {query!r:<16} icontains p50={legacy[0]:.2f}ms '
+                f'p95={legacy[1]:.2f}ms  fts p50={fts[0]:.2f}ms '
+                f'p95={fts[1]:.2f}ms'
+            )
+
+
+    def measure(self, repeat, build_queryset):
+        timings = []
+        for _ in range(repeat):
+            started = time.perf_counter()
+            list(build_queryset())
+            timings.append((time.perf_counter() - started) * 1000)
+        timings.sort()
+        p95 = timings[max(0, int(len(timings) * 0.95) - 1)]
+        return statistics.median(timings), p95
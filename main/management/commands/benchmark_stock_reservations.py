@@ -0,0 +1,80 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.db.models import Sum
+from main.models import Category, Product, ProductSize, Size, StockReservation
+from main.stock import reserve_stock
+
+
+class Command(BaseCommand):
+    help = 'Race parallel buyers for one size and report reservation ' \
+           'throughput. The size is generated and deleted afterwards.'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--buyers', type=int, default=60)
+        parser.add_argument('--attempts', type=int, default=5,
+                            help='Reservations of one item each buyer tries')
+        parser.add_argument('--stock', type=int, default=100)
+
+
+    def handle(self, *args, **options):
+        # The buyers commit on connections of their own, so the data can't
+        # be rolled back; it is deleted instead.
+        category = Category.objects.create(name='Benchmark',
+                                           slug='benchmark-stock-reservations')
+        size = Size.objects.create(name='Benchmark')
+        try:
+            product = Product.objects.create(name='Benchmark',
+                                             slug='benchmark-stock-reservations',
+                                             category=category, color='Black',
+                                             price='10.00')
+            product_size = ProductSize.objects.create(product=product, size=size,
+                                                      stock=options['stock'])
+            won, elapsed = self.race(product_size, options)
+
+            product_size.refresh_from_db(fields=['reserved'])
+            held = StockReservation.objects.filter(product_size=product_size) \
+                .aggregate(total=Sum('quantity'))['total'] or 0
+        finally:
+            # Deleting the category takes the product, size and holds with it.
+            category.delete()
+            size.delete()
+
+        buyers = options['buyers']
+        attempts = buyers * options['attempts']
+        expected = min(options['stock'], attempts)
+        self.stdout.write(
+            f'{buyers} buyers, {attempts} attempts on {options["stock"]} items '
+            f'in {elapsed:.2f}s: {attempts / elapsed:.0f} attempts/s, '
+            f'{won / elapsed:.0f} reservations/s'
+        )
+        self.stdout.write(
+            f'won {won}, counter {product_size.reserved}, held {held}, '
+            f'expected {expected}'
+        )
+        if not won == held == product_size.reserved == expected:
+            raise CommandError('Stock was oversold or reservations drifted')
+        self.stdout.write(self.style.SUCCESS('No oversell'))
+
+
+    def race(self, product_size, options):
+        start = threading.Barrier(options['buyers'])
+
+        def buy(number):
+            won = 0
+            start.wait()
+            try:
+                for _ in range(options['attempts']):
+                    won += reserve_stock(product_size.pk, f'bench-{number}', 1)
+            finally:
+                connection.close()
+            return won
+
+        with ThreadPoolExecutor(max_workers=options['buyers']) as pool:
+            started = time.perf_counter()
+            won = sum(pool.map(buy, range(options['buyers'])))
+            return won, time.perf_counter() - started
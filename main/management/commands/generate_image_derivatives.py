@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand
+from main.images import build_derivatives
+from main.models import Product, ProductImage
+
+
+class Command(BaseCommand):
+    help = 'Build resized WebP/JPEG copies of product images that lack them'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--force', action='store_true',
+                            help='Rebuild images that already have copies')
+
+
+    def handle(self, *args, **options):
+        targets = (
+            (Product, 'main_image', 'main_image_derivatives'),
+            (ProductImage, 'image', 'derivatives'),
+        )
+        for model, field_name, derivatives_field in targets:
+            queryset = model.objects.exclude(**{field_name: ''})
+            if not options['force']:
+                queryset = queryset.filter(**{f'{derivatives_field}__isnull': True})
+
+            ids = list(queryset.values_list('id', flat=True))
+            for pk in ids:
+                build_derivatives(model, pk, field_name, derivatives_field)
+            self.stdout.write(
+                f'{model.__name__}: processed {len(ids)} images'
+            )
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+from main.facets import refresh_category_facets
+from main.models import Category
+
+
+class Command(BaseCommand):
+    help = 'Recount color, size and price facets for every category'
+
+
+    def handle(self, *args, **options):
+        category_ids = list(Category.objects.values_list('id', flat=True))
+        refresh_category_facets(*category_ids)
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt facets for {len(category_ids)} categories'
+        ))
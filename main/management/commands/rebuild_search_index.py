@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+from main.models import Product
+
+
+class Command(BaseCommand):
+    help = 'Rebuild the full-text search vector for every product'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=5000)
+
+
+    def handle(self, *args, **options):
+        batch_size = options['batch_size']
+        updated = 0
+        last_id = 0
+
+        while True:
+            ids = list(
+                Product.objects.filter(id__gt=last_id)
+                .order_by('id')
+                .values_list('id', flat=True)[:batch_size]
+            )
+            if not ids:
+                break
+            updated += Product.objects.filter(
+                id__in=ids
+            ).update_search_vector()
+            last_id = ids[-1]
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Rebuilt search index for {updated} products'
+        ))
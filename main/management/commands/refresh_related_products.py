@@ -0,0 +1,19 @@
+from django.core.management.base import BaseCommand
+from main.models import Product
+from main.related import refresh_related_products
+
+
+class Command(BaseCommand):
+    help = 'Recompute the precomputed related products of every product'
+
+
+    def handle(self, *args, **options):
+        count = 0
+        products = Product.objects.only('id', 'category_id', 'color') \
+            .order_by('id')
+        for product in products.iterator(chunk_size=2000):
+            refresh_related_products(product)
+            count += 1
+        self.stdout.write(self.style.SUCCESS(
+            f'Refreshed related products for {count} products'
+        ))
@@ -0,0 +1,31 @@
+import time
+
+from django.core.management.base import BaseCommand
+from main.stock import release_expired
+
+
+class Command(BaseCommand):
+    help = 'Hand the stock of expired cart reservations back to their sizes'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--interval', type=float, default=0,
+                            help='Keep sweeping, sleeping this many seconds '
+                                 'between passes')
+
+
+    def handle(self, *args, **options):
+        while True:
+            released = 0
+            while True:
+                count = release_expired(options['batch_size'])
+                released += count
+                if count < options['batch_size']:
+                    break
+
+            if released or not options['interval']:
+                self.stdout.write(f'Released {released} reservations')
+            if not options['interval']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,13 @@
+from contextlib import contextmanager
+
+from django.db import transaction
+
+
+@contextmanager
+def rolled_back():
+    """Run the block in a transaction that is always rolled back, so a
+    command can write sample data without leaving any of it behind.
+    """
+    with transaction.atomic():
+        yield
+        transaction.set_rollback(True)
@@ -0,0 +1,41 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:52
+
+import django.contrib.postgres.indexes
+import django.contrib.postgres.search
+from django.db import migrations
+from django.db.models import OuterRef, Subquery
+
+
+def populate_search_vector(apps, schema_editor):
+    if schema_editor.connection.vendor != 'postgresql':
+        return
+    Product = apps.get_model('main', 'Product')
+    vector = Product.objects.filter(pk=OuterRef('pk')).annotate(
+        vector=(
+            django.contrib.postgres.search.SearchVector('name', weight='A', config='english')
+            + django.contrib.postgres.search.SearchVector('color', weight='B', config='english')
+            + django.contrib.postgres.search.SearchVector('category__name', weight='B', config='english')
+            + django.contrib.postgres.search.SearchVector('description', weight='C', config='english')
+        )
+    ).values('vector')[:1]
+    Product.objects.update(search_vector=Subquery(vector))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0002_alter_productimage_image_alter_productsize_product'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='product',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=django.contrib.postgres.indexes.GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+        ),
+        migrations.RunPython(populate_search_vector, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.5 on 2026-10-18 17:57
+
+from decimal import Decimal
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models import Case, CharField, Count, Min, Value, When
+from django.db.models.functions import Lower
+
+
+PRICE_BUCKETS = (
+    ('0-50', Decimal('49.99')),
+    ('50-100', Decimal('99.99')),
+    ('100-250', Decimal('249.99')),
+    ('250-500', Decimal('499.99')),
+    ('500+', None),
+)
+
+
+def populate_facets(apps, schema_editor):
+    Category = apps.get_model('main', 'Category')
+    CategoryFacet = apps.get_model('main', 'CategoryFacet')
+    Product = apps.get_model('main', 'Product')
+    ProductSize = apps.get_model('main', 'ProductSize')
+    bucket = Case(
+        *[When(price__lte=high, then=Value(key))
+          for key, high in PRICE_BUCKETS if high is not None],
+        default=Value(PRICE_BUCKETS[-1][0]),
+        output_field=CharField(),
+    )
+    positions = {key: position for position, (key, high) in enumerate(PRICE_BUCKETS)}
+
+    for category_id in Category.objects.values_list('pk', flat=True):
+        products = Product.objects.filter(category_id=category_id).order_by()
+        facets = [
+            CategoryFacet(category_id=category_id, facet='color',
+                          value=row['value'], count=row['count'])
+            for row in products.annotate(value=Lower('color')).values('value')
+            .annotate(count=Count('id'))
+        ]
+        facets += [
+            CategoryFacet(category_id=category_id, facet='size',
+                          value=row['size__name'], position=row['position'],
+                          count=row['count'])
+            for row in ProductSize.objects.filter(
+                product__category_id=category_id, stock__gt=0,
+            ).values('size__name').annotate(
+                count=Count('product', distinct=True), position=Min('size_id'),
+            ).order_by()
+        ]
+        facets += [
+            CategoryFacet(category_id=category_id, facet='price',
+                          value=row['value'], position=positions[row['value']],
+                          count=row['count'])
+            for row in products.annotate(value=bucket).values('value')
+            .annotate(count=Count('id'))
+        ]
+        CategoryFacet.objects.bulk_create(facets)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0005_product_created_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CategoryFacet',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('facet', models.CharField(choices=[('color', 'Color'), ('size', 'Size'), ('price', 'Price')], max_length=10)),
+                ('value', models.CharField(max_length=100)),
+                ('position', models.PositiveIntegerField(default=0)),
+                ('count', models.PositiveIntegerField(default=0)),
+                ('category', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='facets', to='main.category')),
+            ],
+            options={
+                'unique_together': {('category', 'facet', 'value')},
+            },
+        ),
+        migrations.RunPython(populate_facets, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,83 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:01
+
+import django.db.models.deletion
+import django.db.models.functions.text
+from django.db import migrations, models
+from django.db.models import Case, Count, IntegerField, OuterRef, Q, \
+    Subquery, Value, When
+from django.db.models.functions import Coalesce
+
+
+def populate_related(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    RelatedProduct = apps.get_model('main', 'RelatedProduct')
+    OrderItem = apps.get_model('orders', 'OrderItem')
+
+    for product in Product.objects.only('id', 'category_id', 'color') \
+            .order_by('id').iterator(chunk_size=2000):
+        co_purchases = OrderItem.objects.filter(
+            order__items__product_id=product.pk
+        ).exclude(product_id=product.pk)
+        co_purchase_count = co_purchases.filter(
+            product_id=OuterRef('pk')
+        ).values('product_id').annotate(
+            count=Count('order_id', distinct=True)
+        ).values('count')
+        scored = Product.objects.filter(
+            Q(category_id=product.category_id)
+            | Q(color__iexact=product.color)
+            | Q(pk__in=co_purchases.values('product_id'))
+        ).exclude(pk=product.pk).annotate(
+            score=Case(When(category_id=product.category_id, then=Value(3)),
+                       default=Value(0))
+            + Case(When(color__iexact=product.color, then=Value(2)),
+                   default=Value(0))
+            + Coalesce(Subquery(co_purchase_count, output_field=IntegerField()),
+                       Value(0)) * 5
+        ).order_by('-score', '-created_at').values_list('pk', 'score')[:8]
+        RelatedProduct.objects.bulk_create([
+            RelatedProduct(product_id=product.pk, related_id=related_id,
+                           score=score)
+            for related_id, score in scored
+        ])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0007_image_derivatives'),
+        ('orders', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RelatedProduct',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('score', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='product',
+            index=models.Index(django.db.models.functions.text.Upper('color'), name='product_color_upper_idx'),
+        ),
+        migrations.AddField(
+            model_name='relatedproduct',
+            name='product',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='related_entries', to='main.product'),
+        ),
+        migrations.AddField(
+            model_name='relatedproduct',
+            name='related',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='main.product'),
+        ),
+        migrations.AddIndex(
+            model_name='relatedproduct',
+            index=models.Index(fields=['product', '-score'], name='related_product_score_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='relatedproduct',
+            unique_together={('product', 'related')},
+        ),
+        migrations.RunPython(populate_related, migrations.RunPython.noop),
+    ]
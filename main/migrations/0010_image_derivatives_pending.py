@@ -0,0 +1,42 @@
+# Generated by Django 5.2.5 on 2026-10-18 18:55
+
+from django.db import migrations, models
+
+
+def mark_empty_pending(apps, schema_editor):
+    # An empty list used to mean both "not generated yet" and "too small for
+    # any width"; build those once more so the small ones get recorded.
+    Product = apps.get_model('main', 'Product')
+    ProductImage = apps.get_model('main', 'ProductImage')
+    Product.objects.filter(main_image_derivatives=[]) \
+        .update(main_image_derivatives=None)
+    ProductImage.objects.filter(derivatives=[]).update(derivatives=None)
+
+
+def mark_pending_empty(apps, schema_editor):
+    Product = apps.get_model('main', 'Product')
+    ProductImage = apps.get_model('main', 'ProductImage')
+    Product.objects.filter(main_image_derivatives__isnull=True) \
+        .update(main_image_derivatives=[])
+    ProductImage.objects.filter(derivatives__isnull=True).update(derivatives=[])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('main', '0009_stock_reservations'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='product',
+            name='main_image_derivatives',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.AlterField(
+            model_name='productimage',
+            name='derivatives',
+            field=models.JSONField(blank=True, editable=False, null=True),
+        ),
+        migrations.RunPython(mark_empty_pending, mark_pending_empty),
+    ]
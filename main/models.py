@@ -1,5 +1,14 @@
-from django.db import models
+from django.contrib.postgres.indexes import GinIndex, OpClass
+from django.contrib.postgres.search import SearchQuery, SearchRank, \
+    SearchVector, SearchVectorField, TrigramSimilarity
+from django.db import connection, models
+from django.db.models import F, OuterRef, Q, Subquery, Value
+from django.db.models.functions import Cast, Upper
 from django.utils.text import slugify
+import re
+
+
+SEARCH_CONFIG = 'english'
 
 
 class Category(models.Model):
@@ -11,6 +20,7 @@ class Category(models.Model):
         if not self.slug:
             self.slug = slugify(self.name)
         super().save(*args, **kwargs)
+        self.products.all().update_search_vector()
 
 
     def __str__(self):
@@ -30,12 +40,79 @@ class ProductSize(models.Model):
                                 related_name='product_sizes')
     size = models.ForeignKey(Size, on_delete=models.CASCADE)
     stock = models.PositiveIntegerField(default=0)
+    reserved = models.PositiveIntegerField(default=0)
 
 
     def __str__(self):
         return f"{self.size.name} ({self.stock} in stock) for {self.product.name}"
 
 
+    @property
+    def available(self):
+        return max(self.stock - self.reserved, 0)
+
+
+def product_search_vector():
+    return (
+        SearchVector('name', weight='A', config=SEARCH_CONFIG)
+        + SearchVector('color', weight='B', config=SEARCH_CONFIG)
+        + SearchVector('category__name', weight='B', config=SEARCH_CONFIG)
+        + SearchVector('description', weight='C', config=SEARCH_CONFIG)
+    )
+
+
+class ProductQuerySet(models.QuerySet):
+    def update_search_vector(self):
+        if connection.vendor != 'postgresql':
+            return 0
+        vector = Product.objects.filter(pk=OuterRef('pk')).annotate(
+            vector=product_search_vector()
+        ).values('vector')[:1]
+        return self.update(search_vector=Subquery(vector))
+
+
+    def search(self, query):
+        if connection.vendor != 'postgresql':
+            # Every match ranks the same, so callers can order and paginate
+            # by rank whichever database is in use.
+            return self.filter(
+                Q(name__icontains=query) | Q(description__icontains=query)
+            ).annotate(
+                rank=Value(0, output_field=models.IntegerField())
+            ).order_by('-rank', '-created_at', '-id')
+
+        terms = re.findall(r'\w+', query)
+        if not terms:
+            return self.none()
+
+        # Prefix match every term so partial words typed into the search
+        # box already return results.
+        search_query = SearchQuery(
+            ' & '.join(f'{term}:*' for term in terms),
+            search_type='raw',
+            config=SEARCH_CONFIG,
+        )
+        # The rank is scaled to an integer so that it can be compared exactly
+        # when it is used as the leading key of a pagination cursor.
+        return self.filter(search_vector=search_query).annotate(
+            rank=Cast(
+                SearchRank(F('search_vector'), search_query) * 1000000,
+                models.IntegerField(),
+            )
+        ).order_by('-rank', '-created_at', '-id')
+
+
+    def suggest(self, prefix, limit):
+        queryset = self.filter(name__icontains=prefix)
+        if connection.vendor == 'postgresql':
+            queryset = queryset.annotate(
+                similarity=TrigramSimilarity('name', prefix)
+            ).order_by('-similarity', 'name')
+        else:
+            queryset = queryset.order_by('name')
+        return queryset.values('name', 'slug', 'price')[:limit]
+
+
 class Product(models.Model):
     name = models.CharField(max_length=100)
     slug = models.CharField(max_length=100, unique=True)
@@ -47,12 +124,42 @@ class Product(models.Model):
     main_image = models.ImageField(upload_to='products/main/')
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Widths of the resized copies; None until they have been generated.
+    main_image_derivatives = models.JSONField(null=True, blank=True,
+                                              editable=False)
+    search_vector = SearchVectorField(null=True, editable=False)
+
+    objects = ProductQuerySet.as_manager()
+
+
+    class Meta:
+        indexes = [
+            GinIndex(fields=['search_vector'], name='product_search_vector_idx'),
+            GinIndex(OpClass(Upper('name'), name='gin_trgm_ops'),
+                     name='product_name_trgm_idx'),
+            models.Index(fields=['-created_at', '-id'],
+                         name='product_created_idx'),
+            models.Index(fields=['category', '-created_at', '-id'],
+                         name='product_category_created_idx'),
+            models.Index(Upper('color'), name='product_color_upper_idx'),
+        ]
+
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_category_id = instance.__dict__.get('category_id')
+        instance._loaded_main_image = instance.__dict__.get('main_image')
+        return instance
 
 
     def save(self, *args, **kwargs):
         if not self.slug:
             self.slug = slugify(self.name)
+        if self.main_image.name != getattr(self, '_loaded_main_image', None):
+            self.main_image_derivatives = None
         super().save(*args, **kwargs)
+        Product.objects.filter(pk=self.pk).update_search_vector()
 
 
     def __str__(self):
@@ -63,3 +170,77 @@ class ProductImage(models.Model):
     product = models.ForeignKey(Product, on_delete=models.CASCADE,
                                 related_name='images')
     image = models.ImageField(upload_to='products/extra/')
+    derivatives = models.JSONField(null=True, blank=True, editable=False)
+
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._loaded_image = instance.__dict__.get('image')
+        return instance
+
+
+    def save(self, *args, **kwargs):
+        if self.image.name != getattr(self, '_loaded_image', None):
+            self.derivatives = None
+        super().save(*args, **kwargs)
+
+
+class CategoryFacet(models.Model):
+    FACET_CHOICES = (
+        ('color', 'Color'),
+        ('size', 'Size'),
+        ('price', 'Price'),
+    )
+
+    category = models.ForeignKey(Category, on_delete=models.CASCADE,
+                                 related_name='facets')
+    facet = models.CharField(max_length=10, choices=FACET_CHOICES)
+    value = models.CharField(max_length=100)
+    position = models.PositiveIntegerField(default=0)
+    count = models.PositiveIntegerField(default=0)
+
+
+    class Meta:
+        unique_together = ('category', 'facet', 'value')
+
+
+    def __str__(self):
+        return f"{self.category} {self.facet}={self.value} ({self.count})"
+
+
+class RelatedProduct(models.Model):
+    product = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                related_name='related_entries')
+    related = models.ForeignKey(Product, on_delete=models.CASCADE,
+                                related_name='+')
+    score = models.PositiveIntegerField(default=0)
+
+
+    class Meta:
+        unique_together = ('product', 'related')
+        indexes = [
+            models.Index(fields=['product', '-score'],
+                         name='related_product_score_idx'),
+        ]
+
+
+    def __str__(self):
+        return f"{self.product} -> {self.related} ({self.score})"
+
+
+class StockReservation(models.Model):
+    product_size = models.ForeignKey(ProductSize, on_delete=models.CASCADE,
+                                     related_name='reservations')
+    session_key = models.CharField(max_length=40)
+    quantity = models.PositiveIntegerField()
+    expires_at = models.DateTimeField(db_index=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+
+    class Meta:
+        unique_together = ('session_key', 'product_size')
+
+
+    def __str__(self):
+        return f"{self.quantity} x {self.product_size_id} for {self.session_key}"
@@ -0,0 +1,49 @@
+from django.db import transaction
+from django.db.models import Case, Count, IntegerField, OuterRef, Q, \
+    Subquery, Value, When
+from django.db.models.functions import Coalesce
+from orders.models import OrderItem
+
+from .models import Product, RelatedProduct
+
+
+RELATED_LIMIT = 8
+CATEGORY_WEIGHT = 3
+COLOR_WEIGHT = 2
+CO_PURCHASE_WEIGHT = 5
+
+
+def score_related(product):
+    """Return the best scored other products for `product` in one query."""
+    co_purchases = OrderItem.objects.filter(
+        order__items__product_id=product.pk
+    ).exclude(product_id=product.pk)
+    co_purchase_count = co_purchases.filter(
+        product_id=OuterRef('pk')
+    ).values('product_id').annotate(
+        count=Count('order_id', distinct=True)
+    ).values('count')
+
+    return Product.objects.filter(
+        Q(category_id=product.category_id)
+        | Q(color__iexact=product.color)
+        | Q(pk__in=co_purchases.values('product_id'))
+    ).exclude(pk=product.pk).annotate(
+        score=Case(When(category_id=product.category_id,
+                        then=Value(CATEGORY_WEIGHT)), default=Value(0))
+        + Case(When(color__iexact=product.color,
+                    then=Value(COLOR_WEIGHT)), default=Value(0))
+        + Coalesce(Subquery(co_purchase_count, output_field=IntegerField()),
+                   Value(0)) * CO_PURCHASE_WEIGHT
+    ).order_by('-score', '-created_at').values_list('pk', 'score')[:RELATED_LIMIT]
+
+
+def refresh_related_products(product):
+    rows = [
+        RelatedProduct(product_id=product.pk, related_id=related_id,
+                       score=score)
+        for related_id, score in score_related(product)
+    ]
+    with transaction.atomic():
+        RelatedProduct.objects.filter(product_id=product.pk).delete()
+        RelatedProduct.objects.bulk_create(rows)
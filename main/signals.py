@@ -0,0 +1,55 @@
+from django.db.models.signals import post_delete, post_save
+from django.dispatch import receiver
+
+from .cache import catalog_fragments, categories_cache, \
+    invalidate_category_fragments
+from .facets import refresh_category_facets
+from .images import schedule_derivatives
+from .models import Category, Product, ProductImage, ProductSize
+from .related import refresh_related_products
+
+
+@receiver([post_save, post_delete], sender=Product)
+def product_changed(sender, instance, **kwargs):
+    category_ids = (instance.category_id,
+                    getattr(instance, '_loaded_category_id', None))
+    refresh_category_facets(*category_ids)
+    invalidate_category_fragments(*category_ids)
+
+
+@receiver(post_save, sender=Product)
+def product_saved(sender, instance, **kwargs):
+    refresh_related_products(instance)
+
+
+@receiver(post_save, sender=Product)
+def product_image_saved(sender, instance, **kwargs):
+    if instance.main_image and instance.main_image_derivatives is None:
+        schedule_derivatives(instance, 'main_image', 'main_image_derivatives')
+
+
+@receiver([post_save, post_delete], sender=ProductSize)
+def product_size_changed(sender, instance, **kwargs):
+    category_id = Product.objects.filter(pk=instance.product_id) \
+        .values_list('category_id', flat=True).first()
+    refresh_category_facets(category_id)
+    invalidate_category_fragments(category_id)
+
+
+@receiver([post_save, post_delete], sender=ProductImage)
+def product_image_changed(sender, instance, **kwargs):
+    category_id = Product.objects.filter(pk=instance.product_id) \
+        .values_list('category_id', flat=True).first()
+    invalidate_category_fragments(category_id)
+
+
+@receiver(post_save, sender=ProductImage)
+def extra_image_saved(sender, instance, **kwargs):
+    if instance.image and instance.derivatives is None:
+        schedule_derivatives(instance, 'image', 'derivatives')
+
+
+@receiver([post_save, post_delete], sender=Category)
+def category_changed(sender, instance, **kwargs):
+    categories_cache.invalidate()
+    catalog_fragments.invalidate('all', instance.slug)
@@ -0,0 +1,227 @@
+from collections import defaultdict
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, IntegerField, Q, Value, When
+from django.db.models.functions import Greatest
+from django.utils import timezone
+
+from .cache import invalidate_category_fragments
+from .facets import refresh_category_facets
+from .models import ProductSize, StockReservation
+
+
+def stock_changed(*category_ids):
+    """Recount the in-stock facets and expire the catalog fragments (and
+    with them the ETags) of categories where a size sold out or came back.
+
+    Bulk stock updates skip the ``post_save`` signal that does this for a
+    single size. The work runs once the transaction commits.
+    """
+    category_ids = set(filter(None, category_ids))
+    if not category_ids:
+        return
+
+    def refresh():
+        refresh_category_facets(*category_ids)
+        invalidate_category_fragments(*category_ids)
+    # The order has committed by then, so a failure is logged, not raised.
+    transaction.on_commit(refresh, robust=True)
+
+
+def reserve_stock(product_size_id, session_key, quantity):
+    """Hold `quantity` more of a size for a session and return whether
+    enough unreserved stock was left.
+
+    The size row is only touched by one conditional UPDATE, so concurrent
+    buyers never read stale stock and the row lock lasts a single statement
+    plus the commit. Reservations are always locked before their size rows,
+    the same order the sweep uses.
+    """
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    reservations = StockReservation.objects.filter(
+        product_size_id=product_size_id,
+        session_key=session_key,
+    )
+
+    with transaction.atomic():
+        held = reservations.update(quantity=F('quantity') + quantity,
+                                   expires_at=expires_at)
+        if not held:
+            try:
+                with transaction.atomic():
+                    StockReservation.objects.create(
+                        product_size_id=product_size_id,
+                        session_key=session_key,
+                        quantity=quantity,
+                        expires_at=expires_at,
+                    )
+            except IntegrityError:
+                reservations.update(quantity=F('quantity') + quantity,
+                                    expires_at=expires_at)
+
+        reserved = ProductSize.objects.filter(
+            pk=product_size_id,
+            stock__gte=F('reserved') + quantity,
+        ).update(reserved=F('reserved') + quantity)
+        if not reserved:
+            transaction.set_rollback(True)
+    return bool(reserved)
+
+
+def release_stock(product_size_id, session_key, quantity=None):
+    """Give back part or all of a session's hold on one size."""
+    with transaction.atomic():
+        reservation = StockReservation.objects.select_for_update().filter(
+            product_size_id=product_size_id,
+            session_key=session_key,
+        ).first()
+        if reservation is None:
+            return 0
+
+        if quantity is None or quantity >= reservation.quantity:
+            quantity = reservation.quantity
+            reservation.delete()
+        else:
+            reservation.quantity -= quantity
+            reservation.save(update_fields=['quantity'])
+
+        ProductSize.objects.filter(pk=product_size_id).update(
+            reserved=Greatest(F('reserved') - quantity, Value(0))
+        )
+    return quantity
+
+
+def adjust_reservations(session_key, deltas):
+    """Apply several per-size quantity changes to a session's holds at once.
+
+    `deltas` maps product size ids to the quantity to add (or, when
+    negative, give back). Either every increase fits in the unreserved stock
+    and all changes are applied with one UPDATE of the sizes, or nothing
+    changes and the ids of the sizes that ran short are returned.
+    """
+    deltas = {size_id: delta for size_id, delta in deltas.items() if delta}
+    if not deltas:
+        return []
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+
+    with transaction.atomic():
+        held = dict(StockReservation.objects.select_for_update().filter(
+            session_key=session_key,
+            product_size_id__in=deltas,
+        ).values_list('product_size_id', 'quantity'))
+
+        # A session can only give back what it still holds.
+        changes = {}
+        for size_id, delta in deltas.items():
+            if delta < 0:
+                delta = -min(-delta, held.get(size_id, 0))
+            if delta:
+                changes[size_id] = delta
+        if not changes:
+            return []
+
+        change = Case(*[When(pk=size_id, then=Value(delta))
+                        for size_id, delta in changes.items()],
+                      output_field=IntegerField())
+        fits = Q(stock__gte=F('reserved') + change) \
+            | Q(pk__in=[size_id for size_id, delta in changes.items() if delta < 0])
+        updated = ProductSize.objects.filter(fits, pk__in=changes).update(
+            reserved=Greatest(F('reserved') + change, Value(0))
+        )
+
+        if updated == len(changes):
+            totals = {size_id: held.get(size_id, 0) + delta
+                      for size_id, delta in changes.items()}
+            StockReservation.objects.bulk_create(
+                [StockReservation(product_size_id=size_id,
+                                  session_key=session_key,
+                                  quantity=quantity,
+                                  expires_at=expires_at)
+                 for size_id, quantity in totals.items() if quantity > 0],
+                update_conflicts=True,
+                unique_fields=['session_key', 'product_size'],
+                update_fields=['quantity', 'expires_at'],
+            )
+            StockReservation.objects.filter(
+                session_key=session_key,
+                product_size_id__in=[size_id for size_id, quantity
+                                     in totals.items() if quantity <= 0],
+            ).delete()
+            return []
+        transaction.set_rollback(True)
+
+    return list(ProductSize.objects.filter(
+        pk__in=[size_id for size_id, delta in changes.items() if delta > 0],
+        stock__lt=F('reserved') + change,
+    ).values_list('pk', flat=True))
+
+
+def settle_reservations(reservations, skip_locked=False):
+    """Drop `reservations` in bulk and give their quantity back to the
+    sizes. Returns the number of reservations settled.
+    """
+    rows = list(reservations.select_for_update(skip_locked=skip_locked)
+                .values_list('pk', 'product_size_id', 'quantity'))
+    if not rows:
+        return 0
+
+    totals = defaultdict(int)
+    for pk, product_size_id, quantity in rows:
+        totals[product_size_id] += quantity
+
+    def minus(field):
+        return Greatest(
+            Case(*[When(pk=product_size_id, then=F(field) - quantity)
+                   for product_size_id, quantity in totals.items()],
+                 output_field=IntegerField()),
+            Value(0),
+        )
+
+    ProductSize.objects.filter(pk__in=totals).update(reserved=minus('reserved'))
+    StockReservation.objects.filter(pk__in=[row[0] for row in rows]).delete()
+    return len(rows)
+
+
+def transfer_reservations(session_keys, to_session_key):
+    """Move the holds of `session_keys` to `to_session_key`, adding up
+    quantities for the same size. The reserved counters do not change.
+    """
+    keys = set(session_keys) | {to_session_key}
+    expires_at = timezone.now() + timedelta(seconds=settings.STOCK_RESERVATION_TTL)
+    with transaction.atomic():
+        reservations = StockReservation.objects.filter(session_key__in=keys)
+        totals = defaultdict(int)
+        for product_size_id, quantity in reservations.select_for_update() \
+                .values_list('product_size_id', 'quantity'):
+            totals[product_size_id] += quantity
+        if not totals:
+            return 0
+
+        reservations.delete()
+        StockReservation.objects.bulk_create([
+            StockReservation(product_size_id=product_size_id,
+                             session_key=to_session_key,
+                             quantity=quantity,
+                             expires_at=expires_at)
+            for product_size_id, quantity in totals.items()
+        ])
+    return len(totals)
+
+
+def release_session(session_key):
+    with transaction.atomic():
+        return settle_reservations(
+            StockReservation.objects.filter(session_key=session_key)
+        )
+
+
+def release_expired(batch_size=1000):
+    with transaction.atomic():
+        return settle_reservations(
+            StockReservation.objects.filter(
+                expires_at__lte=timezone.now()
+            ).order_by('pk')[:batch_size],
+            skip_locked=True,
+        )
@@ -0,0 +1,24 @@
+from django import template
+from main.images import derivative_name
+
+
+register = template.Library()
+
+
+def build_srcset(image, widths, extension):
+    return ', '.join(
+        f'{image.storage.url(derivative_name(image.name, width, extension))} {width}w'
+        for width in widths
+    )
+
+
+@register.inclusion_tag('main/includes/responsive_image.html')
+def responsive_image(image, widths, alt='', css_class='', sizes='100vw'):
+    return {
+        'image': image,
+        'alt': alt,
+        'css_class': css_class,
+        'sizes': sizes,
+        'webp_srcset': build_srcset(image, widths, 'webp') if widths else '',
+        'jpeg_srcset': build_srcset(image, widths, 'jpg') if widths else '',
+    }
@@ -1,3 +1,187 @@
-from django.test import TestCase
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.db.models import Sum
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+from .checks import check_versioned_cache
+from .facets import get_facets, refresh_category_facets
+from .models import Category, CategoryFacet, Product, ProductSize, Size, \
+    StockReservation
+from .stock import reserve_stock
+
+
+class ReserveStockRaceTests(TransactionTestCase):
+    BUYERS = 60
+    ATTEMPTS = 5
+    STOCK = 50
+
+
+    def setUp(self):
+        category = Category.objects.create(name='Shirts')
+        product = Product.objects.create(name='Shirt', slug='shirt',
+                                         category=category, color='Blue',
+                                         price='10.00')
+        self.product_size = ProductSize.objects.create(
+            product=product, size=Size.objects.create(name='M'), stock=self.STOCK,
+        )
+
+
+    def test_parallel_buyers_never_oversell(self):
+        start = threading.Barrier(self.BUYERS)
+
+        def buy(number):
+            won = 0
+            start.wait()
+            try:
+                for _ in range(self.ATTEMPTS):
+                    won += reserve_stock(self.product_size.pk, f'buyer-{number}', 1)
+            finally:
+                connection.close()
+            return won
+
+        with ThreadPoolExecutor(max_workers=self.BUYERS) as pool:
+            won = sum(pool.map(buy, range(self.BUYERS)))
+
+        self.product_size.refresh_from_db()
+        held = StockReservation.objects.aggregate(total=Sum('quantity'))['total']
+        self.assertEqual(won, self.STOCK)
+        self.assertEqual(held, self.STOCK)
+        self.assertEqual(self.product_size.reserved, self.STOCK)
+
+
+@override_settings(METRICS_TOKEN='secret')
+class FragmentCacheMetricsTests(TestCase):
+    url = reverse('main:fragment_cache_metrics')
+
+
+    def test_anonymous_requests_are_refused(self):
+        self.assertEqual(self.client.get(self.url).status_code, 404)
+        self.assertEqual(self.client.get(
+            self.url, headers={'Authorization': 'Bearer wrong'},
+        ).status_code, 404)
+
+
+    def test_token(self):
+        response = self.client.get(self.url,
+                                    headers={'Authorization': 'Bearer secret'})
+        self.assertEqual(response.status_code, 200)
+
+
+    def test_staff(self):
+        user = get_user_model()(email='staff@example.com', is_staff=True)
+        user.set_unusable_password()
+        user.save()
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(self.url).status_code, 200)
+
+
+class CatalogViewTests(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        category = Category.objects.create(name='Shirts')
+        Product.objects.bulk_create([
+            Product(name=f'Shirt {number}', slug=f'shirt-{number}',
+                    category=category, color='Blue', price='10.00')
+            for number in range(30)
+        ])
+
+
+    # Other databases fall back to a plain icontains search.
+    @mock.patch('main.models.connection', SimpleNamespace(vendor='sqlite'))
+    def test_search_without_postgres_pages_through_matches(self):
+        url = reverse('main:catalog_all')
+        response = self.client.get(url, {'q': 'shirt'})
+        self.assertEqual(response.status_code, 200)
+        page = response.context['page']
+        self.assertEqual(len(page.object_list), 24)
+
+        response = self.client.get(url, {'q': 'shirt', 'cursor': page.next_cursor})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.context['page'].object_list), 6)
+
+
+    def test_price_bounds(self):
+        url = reverse('main:catalog_all')
+        response = self.client.get(url, {'max_price': '5'})
+        self.assertEqual(response.context['page'].object_list, [])
+
+        for value in ('abc', 'NaN', '1e999999'):
+            with self.subTest(value=value):
+                response = self.client.get(url, {'min_price': value})
+                self.assertEqual(response.status_code, 200)
+                self.assertEqual(len(response.context['page'].object_list), 24)
+
+
+class FacetRefreshTests(TransactionTestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Shirts')
+        self.product = Product.objects.create(name='Shirt', slug='shirt',
+                                              category=self.category,
+                                              color='Blue', price='10.00')
+
+
+    def test_concurrent_refreshes_of_one_category(self):
+        start = threading.Barrier(8)
+
+        def refresh(number):
+            start.wait()
+            try:
+                refresh_category_facets(self.category.pk)
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=8) as pool:
+            list(pool.map(refresh, range(8)))
+
+        self.assertEqual(CategoryFacet.objects.filter(facet='color').count(), 1)
+
+
+    def test_values_that_are_gone_are_removed(self):
+        Product.objects.filter(pk=self.product.pk).update(color='Red')
+        refresh_category_facets(self.category.pk)
+
+        self.assertEqual(get_facets(self.category)['color'],
+                         [{'value': 'red', 'count': 1}])
+
+
+class ImageDerivativeTests(TestCase):
+    def setUp(self):
+        self.category = Category.objects.create(name='Shirts')
+
+
+    @mock.patch('main.signals.schedule_derivatives')
+    def test_images_too_small_for_any_width_are_not_rebuilt(self, schedule):
+        product = Product.objects.create(name='Shirt', slug='shirt',
+                                         category=self.category, color='Blue',
+                                         price='10.00',
+                                         main_image='products/main/tiny.jpg')
+        self.assertEqual(schedule.call_count, 1)
+
+        # What build_derivatives records for an image narrower than 300px.
+        Product.objects.filter(pk=product.pk).update(main_image_derivatives=[])
+        product = Product.objects.get(pk=product.pk)
+        product.name = 'Renamed'
+        product.save()
+        self.assertEqual(schedule.call_count, 1)
+
+
+class VersionedCacheCheckTests(TestCase):
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+    }})
+    def test_per_process_cache_is_refused(self):
+        self.assertEqual([error.id for error in check_versioned_cache(None)],
+                         ['main.E001'])
+
+
+    @override_settings(CACHES={'default': {
+        'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+        'LOCATION': 'redis://localhost:6379',
+    }})
+    def test_shared_cache(self):
+        self.assertEqual(check_versioned_cache(None), [])
@@ -5,7 +5,9 @@ app_name = 'main'
 
 urlpatterns = [
     path('', views.IndexView.as_view(), name='index'),
+    path('search/suggestions/', views.SearchSuggestionsView.as_view(), name='search_suggestions'),
     path('catalog/', views.CatalogView.as_view(), name='catalog_all'),
     path('catalog/<slug:category_slug>/', views.CatalogView.as_view(), name='catalog'),
+    path('metrics/fragment-cache/', views.FragmentCacheMetricsView.as_view(), name='fragment_cache_metrics'),
     path('product/<slug:slug>', views.ProductDetailView.as_view(), name='product_detail'),
 ]
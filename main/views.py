@@ -1,10 +1,55 @@
 from django.shortcuts import render
-from django.shortcuts import get_object_or_404
-from django.views.generic import TemplateView, DetailView
-from django.http import HttpResponse
+from django.views.generic import TemplateView, DetailView, View
+from django.core.cache import cache
+from django.utils.crypto import constant_time_compare
+from django.utils.decorators import method_decorator
+from django.views.decorators.http import condition
+from django.views.decorators.vary import vary_on_headers
+from django.conf import settings
+from django.http import Http404, HttpResponse
 from django.template.response import TemplateResponse
-from .models import Category, Product, Size
-from django.db.models import Q
+from .cache import catalog_fragments, categories_cache
+from .facets import get_facets
+from .models import Product, RelatedProduct
+from .pagination import paginate_keyset
+import hashlib
+from decimal import Decimal, InvalidOperation
+
+
+def catalog_etag(request, category_slug=None):
+    state = '|'.join([
+        request.get_full_path(),
+        request.headers.get('HX-Request', ''),
+        catalog_fragments.version(category_slug or 'all'),
+        categories_cache.version(),
+    ])
+    return hashlib.md5(state.encode()).hexdigest()
+
+
+def get_product_state(request, slug):
+    if not hasattr(request, '_product_state'):
+        request._product_state = Product.objects.filter(slug=slug) \
+            .values_list('updated_at', 'category__slug').first()
+    return request._product_state
+
+
+def product_last_modified(request, slug):
+    state = get_product_state(request, slug)
+    return state[0] if state else None
+
+
+def product_etag(request, slug):
+    state = get_product_state(request, slug)
+    if state is None:
+        return None
+    updated_at, category_slug = state
+    state = '|'.join([
+        updated_at.isoformat(),
+        request.headers.get('HX-Request', ''),
+        catalog_fragments.version(category_slug),
+        categories_cache.version(),
+    ])
+    return hashlib.md5(state.encode()).hexdigest()
 
 
 class IndexView(TemplateView):
@@ -13,7 +58,7 @@ class IndexView(TemplateView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        context['categories'] = Category.objects.all()
+        context['categories'] = categories_cache.get()
         context['current_category'] = None
         return context
 
@@ -25,32 +70,53 @@ class IndexView(TemplateView):
         return TemplateResponse(request, self.template_name, context)
 
 
+def filter_price(queryset, lookup, value):
+    # Bounds that aren't a number, or that no price column value can reach,
+    # are ignored rather than passed on to the database.
+    try:
+        price = Decimal(value)
+    except InvalidOperation:
+        return queryset
+    field = Product._meta.get_field('price')
+    if not price.is_finite() \
+            or price.adjusted() >= field.max_digits - field.decimal_places:
+        return queryset
+    return queryset.filter(**{f'price__{lookup}': price})
+
+
+@method_decorator(vary_on_headers('HX-Request'), name='get')
+@method_decorator(condition(etag_func=catalog_etag), name='get')
 class CatalogView(TemplateView):
-    template = 'main/base.html'
+    template_name = 'main/base.html'
+    paginate_by = 24
 
     FILTER_MAPPING = {
         'color': lambda queryset, value: queryset.filter(color__iexact=value),
-        'min_price': lambda queryset, value: queryset.filter(price_gte=value),
-        'max_price': lambda queryset, value: queryset.filter(price_lte=value),
-        'size': lambda queryset, value: queryset.filter(product_sizes__size__name=value),
+        'min_price': lambda queryset, value: filter_price(queryset, 'gte', value),
+        'max_price': lambda queryset, value: filter_price(queryset, 'lte', value),
+        'size': lambda queryset, value: queryset.filter(product_sizes__size__name=value,
+                                                        product_sizes__stock__gt=0),
     }
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
         category_slug = kwargs.get('category_slug')
-        categories = Category.objects.all()
+        categories = categories_cache.get()
         products = Product.objects.all().order_by('-created_at')
         current_category = None
 
         if category_slug:
-            current_category = get_object_or_404(Category, slug=category_slug)
+            current_category = next((category for category in categories
+                                     if category.slug == category_slug), None)
+            if current_category is None:
+                raise Http404('No category matches the given query.')
             products = products.filter(category=current_category)
 
         query = self.request.GET.get('q')
+        cursor_fields = ('created_at', 'id')
         if query:
-            products = products.filter(
-                Q(name__icontains=query) | Q(description__icontains=query)
-            )
+            products = products.search(query)
+            cursor_fields = ('rank', 'created_at', 'id')
 
         filter_params = {}
         for param, filter_func in self.FILTER_MAPPING.items():
@@ -63,15 +129,21 @@ class CatalogView(TemplateView):
 
         filter_params['q'] = query or ''
 
+        page = paginate_keyset(products, self.request.GET.get('cursor'),
+                               self.paginate_by, cursor_fields,
+                               params=self.request.GET)
+
         context.update({
             'categories': categories,
-            'products': products,
+            'page': page,
             'current_category': category_slug,
             'filter_params': filter_params,
-            'sizes': Size.objects.all(),
             'search_query': query or ''
         })
 
+        if self.request.GET.get('show_filters') == 'true':
+            context['facets'] = get_facets(current_category)
+
         if self.request.GET.get('show_search') == 'true':
             context['show_search'] = True
         elif self.request.GET.get('reset_search') == 'true':
@@ -80,20 +152,62 @@ class CatalogView(TemplateView):
         return context
 
 
+    def get_fragment_template(self):
+        params = self.request.GET
+        if 'true' in (params.get('show_search'), params.get('reset_search'),
+                      params.get('show_filters')):
+            return None
+        return 'main/catalog_page.html' if params.get('cursor') else 'main/catalog.html'
+
+
+    def get_fragment_params(self):
+        params = {}
+        for param in ('q', 'cursor', *self.FILTER_MAPPING):
+            value = self.request.GET.get(param, '').strip()
+            if param in ('q', 'color'):
+                value = ' '.join(value.lower().split())
+            if value:
+                params[param] = value
+        return params
+
+
+    def render_fragment(self, template_name, **kwargs):
+        scope = kwargs.get('category_slug') or 'all'
+        params = self.get_fragment_params()
+        content, version = catalog_fragments.get(scope, template_name, params)
+        if content is not None:
+            return HttpResponse(content)
+
+        context = self.get_context_data(**kwargs)
+        response = TemplateResponse(self.request, template_name, context).render()
+        catalog_fragments.set(scope, template_name, params,
+                              response.content, version)
+        return response
+
+
     def get(self, request, *args, **kwargs):
+        if request.headers.get('HX-Request'):
+            template_name = self.get_fragment_template()
+            if template_name:
+                return self.render_fragment(template_name, **kwargs)
+
         context = self.get_context_data(**kwargs)
         if request.headers.get('HX-Request'):
             if context.get('show_search'):
                 return TemplateResponse(request, 'main/search_input.html', context)
             elif context.get('reset_search'):
                 return TemplateResponse(request, 'main/search_button.html', {})
-            template = 'main/filter_modal.html' if request.GET.get('show_filters') == 'true' else 'main/catalog.html'
-            return TemplateResponse(request, template, context)
+            return TemplateResponse(request, 'main/filter_modal.html', context)
         return TemplateResponse(request, self.template_name, context)
 
 
+@method_decorator(vary_on_headers('HX-Request'), name='get')
+@method_decorator(condition(etag_func=product_etag,
+                            last_modified_func=product_last_modified),
+                  name='get')
 class ProductDetailView(DetailView):
     model = Product
+    queryset = Product.objects.select_related('category')
     template_name = 'main/base.html'
     slug_field = 'slug'
     slug_url_kwarg = 'slug'
@@ -101,11 +215,13 @@ class ProductDetailView(DetailView):
 
     def get_context_data(self, **kwargs):
         context = super().get_context_data(**kwargs)
-        product = self.get_object()
-        context['categories'] = Category.objects.all()
-        context['related_products'] = Product.objects.filter(
-            category=product.category
-        ).exclude(id=product.id)[:4]
+        product = self.object
+        context['categories'] = categories_cache.get()
+        context['related_products'] = [
+            entry.related for entry in RelatedProduct.objects.filter(
+                product=product
+            ).select_related('related').order_by('-score')[:4]
+        ]
         context['current_category'] = product.category.slug
         return context
 
@@ -116,3 +232,49 @@ class ProductDetailView(DetailView):
         if request.headers.get('HX-Request'):
             return TemplateResponse(request, 'main/product_detail.html', context)
         return TemplateResponse(request, self.template_name, context)
+
+
+class SearchSuggestionsView(View):
+    min_length = 2
+    limit = 8
+    cache_timeout = 30
+
+
+    def get(self, request):
+        query = ' '.join(request.GET.get('q', '').split()).lower()
+        context = {'suggestions': [], 'search_query': ''}
+
+        if len(query) >= self.min_length:
+            # Queries hold spaces and any characters, which Memcached keys can't.
+            cache_key = 'search_suggestions:' \
+                + hashlib.md5(query.encode()).hexdigest()
+            suggestions = cache.get(cache_key)
+            if suggestions is None:
+                suggestions = list(Product.objects.suggest(query, self.limit))
+                cache.set(cache_key, suggestions, self.cache_timeout)
+            context = {'suggestions': suggestions, 'search_query': query}
+
+        return TemplateResponse(request, 'main/search_suggestions.html', context)
+
+
+class FragmentCacheMetricsView(View):
+    def get(self, request):
+        if not self.authorized(request):
+            raise Http404
+
+        stats = catalog_fragments.stats()
+        lines = [
+            f'catalog_fragment_cache_{outcome}_total {count}'
+            for outcome, count in stats.items()
+        ]
+        return HttpResponse('\n'.join(lines) + '\n',
+                            content_type='text/plain; version=0.0.4')
+
+
+    def authorized(self, request):
+        if request.user.is_staff:
+            return True
+        return bool(settings.METRICS_TOKEN) and constant_time_compare(
+            request.headers.get('Authorization', ''),
+            f'Bearer {settings.METRICS_TOKEN}',
+        )
@@ -1,20 +1,22 @@
 from django.contrib import admin
 from django.utils.safestring import mark_safe
+from main.pagination import EstimatedCountPaginator
 from .models import Order, OrderItem
 
 
 class OrderItemInline(admin.TabularInline):
     model = OrderItem
     extra = 0
-    fields = ('image_preview', 'product', 'size', 'quantity',
-              'price', 'get_total_price')
-    readonly_fields = ('image_preview', 'get_total_price')
+    fields = ('image_preview', 'product_name', 'size_name', 'color',
+              'quantity', 'price', 'get_total_price')
+    readonly_fields = ('image_preview', 'product_name', 'size_name', 'color',
+                       'get_total_price')
     can_delete = False
 
 
     def image_preview(self, obj):
-        if obj.product.main_image:
-            return mark_safe(f'<img src="{obj.product.main_image.url}" style="max-height: 100px; "max-width: 100px; object-fit: cover;" />')
+        if obj.image:
+            return mark_safe(f'<img src="{obj.image.url}" style="max-height: 100px; "max-width: 100px; object-fit: cover;" />')
         return mark_safe('<span style="color: gray;"> No Image</span>')
     image_preview.short_description = 'Image'
 
@@ -32,9 +34,15 @@ class OrderAdmin(admin.ModelAdmin):
     list_display = ('id', 'user', 'email',
                     'total_price', 'payment_provider',
                     'status', 'created_at', 'updated_at')
-    list_filter = ('status', 'first_name', 'last_name')
-    search_fields = ('email', 'first_name', 'last_name')
-    date_hierarchy = 'created_at'
+    # Choice and date filters render without querying the table; each one
+    # has an index ending in (-created_at, -id) to match the ordering.
+    list_filter = ('status', 'payment_provider', 'created_at')
+    search_fields = ('email',)
+    list_select_related = ('user',)
+    raw_id_fields = ('user',)
+    ordering = ('-created_at', '-id')
+    paginator = EstimatedCountPaginator
+    show_full_result_count = False
     readonly_fields = ('created_at', 'updated_at', 'total_price', 'stripe_payment_intent_id')
     inlines = [OrderItemInline]
 
@@ -0,0 +1,215 @@
+import hashlib
+from collections import defaultdict
+from contextlib import contextmanager
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import IntegrityError, connection, transaction
+from django.db.models import Case, F, IntegerField, Value, When
+from django.utils import timezone
+
+from cart.models import Cart, CartItem
+from main.models import Product, ProductSize, StockReservation
+from main.stock import adjust_reservations, stock_changed
+from .models import IdempotencyKey, Order, OrderItem
+
+
+ORDER_FIELDS = (
+    'first_name', 'last_name', 'email', 'company', 'address1', 'address2',
+    'city', 'country', 'province', 'postal_code', 'phone',
+)
+
+# Locks the sizes of every cart line in id order, so two checkouts sharing
+# sizes queue up instead of deadlocking, then takes each line out of stock
+# if there is enough of it and what is left still covers the other sessions'
+# holds (the counters can drift below the holds, so both are checked). The
+# session's own holds are given back in the same statement.
+TAKE_STOCK_SQL = f'''
+    WITH locked AS MATERIALIZED (
+        SELECT size.id
+        FROM {ProductSize._meta.db_table} size
+        WHERE size.id IN (
+            SELECT product_size_id FROM {CartItem._meta.db_table}
+            WHERE cart_id = %(cart)s
+        )
+        ORDER BY size.id
+        FOR UPDATE
+    ),
+    line AS (
+        SELECT item.product_size_id, SUM(item.quantity) AS quantity,
+               COALESCE(MAX(hold.quantity), 0) AS held
+        FROM {CartItem._meta.db_table} item
+        LEFT JOIN {StockReservation._meta.db_table} hold
+            ON hold.product_size_id = item.product_size_id
+            AND hold.session_key = %(session_key)s
+        WHERE item.cart_id = %(cart)s
+        GROUP BY item.product_size_id
+    )
+    UPDATE {ProductSize._meta.db_table} size
+    SET stock = size.stock - line.quantity,
+        reserved = GREATEST(size.reserved - line.held, 0)
+    FROM line, {Product._meta.db_table} product
+    WHERE size.id = line.product_size_id
+        AND product.id = size.product_id
+        AND size.id IN (SELECT id FROM locked)
+        AND size.stock >= line.quantity
+        AND size.stock - line.quantity >= size.reserved - line.held
+    RETURNING size.id, size.stock, product.category_id
+'''
+
+
+class OutOfStock(Exception):
+    def __init__(self, product_size_ids):
+        super().__init__('Some items are no longer available in the '
+                         'requested quantity.')
+        self.product_size_ids = product_size_ids
+
+
+def place_order(cart, user, cleaned_data, payment_provider):
+    """Turn `cart` into an order in a fixed number of queries, whatever the
+    number of lines. Stock is taken for every line or, when any line is
+    short, nothing is written and `OutOfStock` is raised.
+    """
+    with transaction.atomic():
+        # Holds are locked before their sizes, the same order as the sweep.
+        list(StockReservation.objects.select_for_update()
+             .filter(session_key=cart.session_key).values_list('pk'))
+        # Concurrent checkouts of one cart queue here; the later ones find
+        # it empty once the first commits.
+        list(Cart.objects.select_for_update().filter(pk=cart.pk).values_list('pk'))
+
+        lines = list(cart.items.order_by('pk').values(
+            'product_id', 'product_size_id', 'quantity',
+            price=F('product__price'),
+            product_name=F('product__name'),
+            size_name=F('product_size__size__name'),
+            color=F('product__color'),
+            image=F('product__main_image'),
+        ))
+        sizes = {line['product_size_id'] for line in lines}
+
+        with connection.cursor() as cursor:
+            cursor.execute(TAKE_STOCK_SQL, {'cart': cart.pk,
+                                            'session_key': cart.session_key})
+            rows = cursor.fetchall()
+        taken = {size_id for size_id, stock, category_id in rows}
+        if not lines or taken != sizes:
+            raise OutOfStock(sorted(sizes - taken))
+        stock_changed(*[category_id for size_id, stock, category_id in rows
+                        if stock == 0])
+
+        StockReservation.objects.filter(session_key=cart.session_key,
+                                        product_size_id__in=sizes).delete()
+
+        order = Order.objects.create(
+            user=user,
+            special_instructions='',
+            total_price=cart.items.summary()['subtotal'],
+            payment_provider=payment_provider,
+            **{field: cleaned_data[field] for field in ORDER_FIELDS},
+        )
+        OrderItem.objects.bulk_create([
+            OrderItem(order=order,
+                      product_id=line['product_id'],
+                      size_id=line['product_size_id'],
+                      quantity=line['quantity'],
+                      price=line['price'],
+                      product_name=line['product_name'],
+                      size_name=line['size_name'],
+                      color=line['color'],
+                      image=line['image'])
+            for line in lines
+        ])
+        cart.clear()
+    return order
+
+
+def restore_order(order, cart):
+    """Undo `place_order` when the payment could not be started.
+
+    The order is committed before the payment provider is called, so a
+    failed call cannot roll it back. Instead the stock goes back on hold for
+    the cart's session, the lines go back into the cart and the order is
+    deleted, together with its idempotency key.
+    """
+    with transaction.atomic():
+        lines = list(order.items.filter(size__isnull=False)
+                     .values_list('product_id', 'size_id', 'quantity'))
+        totals = defaultdict(int)
+        for product_id, size_id, quantity in lines:
+            totals[size_id] += quantity
+
+        if totals:
+            stock_changed(*ProductSize.objects.filter(pk__in=totals, stock=0)
+                          .values_list('product__category_id', flat=True))
+            back = Case(*[When(pk=size_id, then=Value(quantity))
+                          for size_id, quantity in totals.items()],
+                        output_field=IntegerField())
+            ProductSize.objects.filter(pk__in=totals) \
+                .update(stock=F('stock') + back)
+            adjust_reservations(cart.session_key, totals)
+
+            CartItem.objects.bulk_create(
+                [CartItem(cart=cart, product_id=product_id,
+                          product_size_id=size_id, quantity=quantity)
+                 for product_id, size_id, quantity in lines],
+                update_conflicts=True,
+                unique_fields=['cart', 'product', 'product_size'],
+                update_fields=['quantity'],
+            )
+            Cart.objects.filter(pk=cart.pk).repair_totals()
+        order.delete()
+
+
+@contextmanager
+def checkout_lock(user, key):
+    """Let one request at a time submit a given checkout form.
+
+    The lock is a session-level advisory lock, so it lasts across the
+    commit of the order and the payment call that follows it. A duplicate
+    submit waits here and then finds the finished checkout to replay.
+    """
+    digest = hashlib.blake2b(f'checkout:{user.pk}:{key}'.encode(), digest_size=8)
+    lock_id = int.from_bytes(digest.digest(), 'big', signed=True)
+    with connection.cursor() as cursor:
+        cursor.execute('SELECT pg_advisory_lock(%s)', [lock_id])
+    try:
+        yield
+    finally:
+        with connection.cursor() as cursor:
+            cursor.execute('SELECT pg_advisory_unlock(%s)', [lock_id])
+
+
+def find_checkout(user, key):
+    """Return the live record of an earlier checkout submitted with `key`."""
+    return IdempotencyKey.objects.filter(
+        user=user, key=key, expires_at__gt=timezone.now(),
+    ).select_related('order').first()
+
+
+def claim_checkout(user, key):
+    """Record that a checkout with `key` is being placed and return None, or
+    return the record of the request that already placed it.
+
+    Call it inside the transaction that places the order, so a rolled back
+    checkout leaves the key free for a retry. The unique index backs up
+    ``checkout_lock``: a concurrent request with the same key waits on it
+    until that transaction ends.
+    """
+    now = timezone.now()
+    IdempotencyKey.objects.filter(user=user, key=key, expires_at__lte=now).delete()
+    try:
+        with transaction.atomic():
+            IdempotencyKey.objects.create(
+                user=user,
+                key=key,
+                expires_at=now + timedelta(seconds=settings.CHECKOUT_IDEMPOTENCY_TTL),
+            )
+    except IntegrityError:
+        return IdempotencyKey.objects.select_related('order').get(user=user, key=key)
+    return None
+
+
+def record_checkout(user, key, order, redirect_url=''):
+    IdempotencyKey.objects.filter(user=user, key=key) \
+        .update(order=order, redirect_url=redirect_url)
@@ -0,0 +1,55 @@
+import time
+
+from django.core.management.base import BaseCommand
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+from main.models import Product, ProductSize
+from orders.models import OrderItem
+
+
+# Shown for lines whose product was deleted before its name was copied.
+DELETED_PRODUCT = 'Deleted product'
+
+
+class Command(BaseCommand):
+    help = 'Copy product name, size label, color and image onto order lines ' \
+           'placed before they were stored with the order. Lines whose ' \
+           f'product is gone are named "{DELETED_PRODUCT}".'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000)
+        parser.add_argument('--sleep', type=float, default=0,
+                            help='Seconds to pause between batches')
+
+
+    def handle(self, *args, **options):
+        pending = OrderItem.objects.filter(product_name='') \
+            .order_by('pk').values_list('pk', flat=True)
+        product = Product.objects.filter(pk=OuterRef('product_id'))
+        size = ProductSize.objects.filter(pk=OuterRef('size_id'))
+        snapshot = {
+            'product_name': Coalesce(Subquery(product.values('name')[:1]),
+                                     Value(DELETED_PRODUCT)),
+            'color': Coalesce(Subquery(product.values('color')[:1]), Value('')),
+            'image': Coalesce(Subquery(product.values('main_image')[:1]), Value('')),
+            'size_name': Coalesce(Subquery(size.values('size__name')[:1]), Value('')),
+        }
+
+        updated = 0
+        last_pk = 0
+        started = time.perf_counter()
+        while True:
+            batch = list(pending.filter(pk__gt=last_pk)[:options['batch_size']])
+            if not batch:
+                break
+            last_pk = batch[-1]
+            updated += OrderItem.objects.filter(pk__in=batch).update(**snapshot)
+
+            if options['sleep']:
+                time.sleep(options['sleep'])
+        elapsed = time.perf_counter() - started
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Backfilled {updated} order lines in {elapsed:.2f}s'
+        ))
@@ -0,0 +1,108 @@
+import time
+import uuid
+
+from django.contrib import admin
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.core.paginator import Paginator
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from main.management.rollback import rolled_back
+from orders.models import Order
+
+
+# The changelist settings OrderAdmin had before it was tuned for large tables.
+LEGACY_OPTIONS = {
+    'list_filter': ('status', 'first_name', 'last_name'),
+    'search_fields': ('email', 'first_name', 'last_name'),
+    'date_hierarchy': 'created_at',
+    'list_select_related': False,
+    'ordering': None,
+    'paginator': Paginator,
+    'show_full_result_count': True,
+}
+
+
+class Command(BaseCommand):
+    help = 'Time the order changelist before and after the large-table ' \
+           'changes on generated orders. Everything it writes is rolled back.'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--orders', type=int, default=200000)
+        parser.add_argument('--users', type=int, default=500)
+
+
+    def handle(self, *args, **options):
+        url = reverse('admin:orders_order_changelist')
+        views = (
+            ('all', ''),
+            ('status', '?status__exact=shipped'),
+            ('search', f'?q=buyer{options["users"] // 2}@'),
+        )
+        # The admin URLs are bound to the registered instance, so the old
+        # settings are set on it and removed again afterwards.
+        model_admin = admin.site._registry[Order]
+        try:
+            with rolled_back(), override_settings(ALLOWED_HOSTS=['*']):
+                staff = self.generate(options)
+                client = Client()
+                client.force_login(staff)
+
+                self.stdout.write(f'{"":<8} {"view":<8} {"ms":>8} {"queries":>8}  '
+                                  f'({options["orders"]} orders)')
+                for label in ('before', 'after'):
+                    for option, value in LEGACY_OPTIONS.items():
+                        if label == 'before':
+                            setattr(model_admin, option, value)
+                        else:
+                            model_admin.__dict__.pop(option, None)
+                    for name, query in views:
+                        client.get(url + query)
+                        with CaptureQueriesContext(connection) as queries:
+                            started = time.perf_counter()
+                            client.get(url + query)
+                            elapsed = time.perf_counter() - started
+                        self.stdout.write(f'{label:<8} {name:<8} {elapsed * 1000:>8.1f} '
+                                          f'{len(queries):>8}')
+        finally:
+            for option in LEGACY_OPTIONS:
+                model_admin.__dict__.pop(option, None)
+
+
+    def generate(self, options):
+        User = get_user_model()
+        prefix = uuid.uuid4().hex[:8]
+        staff = User(email=f'{prefix}-staff@orders.invalid', is_staff=True,
+                     is_superuser=True)
+        staff.set_unusable_password()
+        staff.save()
+        User.objects.bulk_create([
+            User(email=f'buyer{number}@{prefix}.invalid', password='!')
+            for number in range(options['users'])
+        ])
+        first_user = User.objects.filter(email__endswith=f'@{prefix}.invalid') \
+            .order_by('pk').values_list('pk', flat=True).first()
+
+        with connection.cursor() as cursor:
+            cursor.execute(f'''
+                INSERT INTO {Order._meta.db_table} (
+                    user_id, first_name, last_name, email, special_instructions,
+                    total_price, status, payment_provider, created_at, updated_at
+                )
+                SELECT %(first_user)s + n %% %(users)s,
+                       'First' || n, 'Last' || n,
+                       'buyer' || n %% %(users)s || '@{prefix}.invalid', '',
+                       (n %% 500) + 0.99,
+                       (ARRAY['pending', 'processing', 'shipped',
+                              'delivered', 'cancelled'])[1 + n %% 5],
+                       'stripe',
+                       now() - n * interval '1 minute',
+                       now() - n * interval '1 minute'
+                FROM generate_series(1, %(orders)s) AS n
+            ''', {'first_user': first_user, 'users': options['users'],
+                  'orders': options['orders']})
+            cursor.execute(f'ANALYZE {Order._meta.db_table}')
+        return staff
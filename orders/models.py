@@ -1,4 +1,6 @@
+from django.contrib.postgres.indexes import GinIndex, OpClass
 from django.db import models
+from django.db.models.functions import Upper
 from django.conf import settings
 from main.models import Product, ProductSize
 
@@ -37,22 +39,61 @@ class Order(models.Model):
     updated_at = models.DateTimeField(auto_now=True)
 
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['user', '-created_at', '-id'],
+                         name='order_user_created_idx'),
+            models.Index(fields=['-created_at', '-id'],
+                         name='order_created_idx'),
+            models.Index(fields=['status', '-created_at', '-id'],
+                         name='order_status_created_idx'),
+            models.Index(fields=['payment_provider', '-created_at', '-id'],
+                         name='order_provider_created_idx'),
+            GinIndex(OpClass(Upper('email'), name='gin_trgm_ops'),
+                     name='order_email_trgm_idx'),
+        ]
+
+
     def __str__(self):
         return f"Order {self.id} by {self.email}"
 
 
 class OrderItem(models.Model):
     order = models.ForeignKey(Order, on_delete=models.CASCADE, related_name='items')
-    product = models.ForeignKey(Product, on_delete=models.CASCADE)
-    size = models.ForeignKey(ProductSize, on_delete=models.CASCADE)
+    product = models.ForeignKey(Product, on_delete=models.SET_NULL, null=True)
+    size = models.ForeignKey(ProductSize, on_delete=models.SET_NULL, null=True)
     quantity = models.PositiveIntegerField()
     price = models.DecimalField(max_digits=10, decimal_places=2)
+    # Copied from the catalog when the order is placed, so an order reads
+    # the same after the product is renamed, restyled or deleted.
+    product_name = models.CharField(max_length=100, blank=True)
+    size_name = models.CharField(max_length=20, blank=True)
+    color = models.CharField(max_length=100, blank=True)
+    image = models.ImageField(upload_to='products/main/', blank=True)
 
 
     def __str__(self):
-        return f"{self.product.name} - {self.size.size.name} ({self.quantity})"
+        return f"{self.product_name} - {self.size_name} ({self.quantity})"
 
 
     def get_total_price(self):
         return self.price * self.quantity
-     
\ No newline at end of file
+     
+
+class IdempotencyKey(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='idempotency_keys')
+    key = models.CharField(max_length=64)
+    order = models.ForeignKey(Order, on_delete=models.CASCADE, null=True,
+                              blank=True, related_name='+')
+    redirect_url = models.URLField(max_length=2048, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    expires_at = models.DateTimeField(db_index=True)
+
+
+    class Meta:
+        unique_together = ('user', 'key')
+
+
+    def __str__(self):
+        return f"Checkout {self.key} by {self.user_id}"
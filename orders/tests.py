@@ -1,3 +1,166 @@
-from django.test import TestCase
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from types import SimpleNamespace
+from unittest import mock
 
-# Create your tests here.
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.test import Client, TestCase, TransactionTestCase
+from django.urls import reverse
+from cart.models import Cart, CartItem
+from main.models import Category, Product, ProductSize, Size
+from main.stock import adjust_reservations
+from .checkout import OutOfStock, place_order
+from .models import Order
+
+
+ADDRESS = {
+    'first_name': 'Query', 'last_name': 'Budget', 'email': 'budget@example.com',
+    'company': '', 'address1': 'Street 1', 'address2': '', 'city': 'City',
+    'country': 'Country', 'province': '', 'postal_code': '00000', 'phone': '',
+}
+
+
+class PlaceOrderTests(TestCase):
+    # Whatever the number of lines, placing an order runs this many queries.
+    QUERIES = 12
+
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.user = get_user_model()(email='budget@example.com',
+                                    first_name='Query', last_name='Budget')
+        cls.user.set_unusable_password()
+        cls.user.save()
+        category = Category.objects.create(name='Shirts')
+        cls.product = Product.objects.create(name='Shirt', slug='shirt',
+                                             category=category, color='Blue',
+                                             price='10.00')
+        cls.sizes = ProductSize.objects.bulk_create([
+            ProductSize(product=cls.product, stock=10,
+                        size=Size.objects.create(name=f'S{number}'))
+            for number in range(25)
+        ])
+
+
+    def fill_cart(self, sizes):
+        cart = Cart.objects.create(session_key=f'budget-{len(sizes)}')
+        CartItem.objects.bulk_create([
+            CartItem(cart=cart, product=self.product, product_size=size, quantity=2)
+            for size in sizes
+        ])
+        # Half of the lines are held the way the cart views hold them.
+        adjust_reservations(cart.session_key, {size.pk: 2 for size in sizes[::2]})
+        Cart.objects.filter(pk=cart.pk).repair_totals()
+        cart.refresh_from_db()
+        return cart
+
+
+    def test_query_count_does_not_grow_with_lines(self):
+        for lines in (1, 5, 25):
+            with self.subTest(lines=lines):
+                sizes = self.sizes[:lines]
+                cart = self.fill_cart(sizes)
+                with self.assertNumQueries(self.QUERIES):
+                    order = place_order(cart, self.user, ADDRESS, 'stripe')
+
+                self.assertEqual(order.items.count(), lines)
+                self.assertEqual(ProductSize.objects.filter(
+                    pk__in=[size.pk for size in sizes], stock=8, reserved=0,
+                ).count(), lines)
+                self.assertFalse(cart.items.exists())
+                ProductSize.objects.update(stock=10, reserved=0)
+
+
+    def test_short_line_writes_nothing(self):
+        sizes = self.sizes[:3]
+        cart = self.fill_cart(sizes)
+        ProductSize.objects.filter(pk=sizes[1].pk).update(stock=1)
+
+        with self.assertRaises(OutOfStock) as caught:
+            place_order(cart, self.user, ADDRESS, 'stripe')
+
+        self.assertEqual(caught.exception.product_size_ids, [sizes[1].pk])
+        self.assertEqual(ProductSize.objects.filter(
+            pk__in=[sizes[0].pk, sizes[2].pk], stock=10, reserved=2,
+        ).count(), 2)
+        self.assertEqual(cart.items.count(), 3)
+        self.assertFalse(self.user.orders.exists())
+
+
+class CheckoutViewTests(TestCase):
+    def test_overlong_idempotency_key_is_rejected(self):
+        user = get_user_model()(email='long@example.com')
+        user.set_unusable_password()
+        user.save()
+        self.client.force_login(user)
+
+        response = self.client.post(reverse('orders:checkout'),
+                                    {'idempotency_key': 'k' * 65})
+        self.assertEqual(response.status_code, 400)
+
+
+class CheckoutIdempotencyTests(TransactionTestCase):
+    REQUESTS = 10
+
+
+    def setUp(self):
+        self.user = get_user_model()(email='double@example.com',
+                                     first_name='Double', last_name='Submit')
+        self.user.set_unusable_password()
+        self.user.save()
+        category = Category.objects.create(name='Shirts')
+        product = Product.objects.create(name='Shirt', slug='shirt',
+                                         category=category, color='Blue',
+                                         price='10.00')
+        self.product_size = ProductSize.objects.create(
+            product=product, size=Size.objects.create(name='M'), stock=5,
+        )
+        cart = Cart.objects.create(session_key='double-submit', user=self.user)
+        CartItem.objects.create(cart=cart, product=product,
+                                product_size=self.product_size, quantity=1)
+        Cart.objects.filter(pk=cart.pk).repair_totals()
+
+
+    def test_parallel_submits_place_one_order(self):
+        payments = []
+
+        def create_payment(order, request):
+            payments.append(order.pk)
+            # A slow payment call keeps the duplicates waiting on the first.
+            time.sleep(0.2)
+            return SimpleNamespace(url=f'https://checkout.stripe.invalid/{order.pk}')
+
+        data = {
+            'idempotency_key': 'double-submit',
+            'payment_provider': 'stripe',
+            'first_name': 'Double', 'last_name': 'Submit', 'email': self.user.email,
+            'address1': 'Street 1', 'city': 'City', 'country': 'Country',
+            'postal_code': '00000',
+        }
+        clients = []
+        for _ in range(self.REQUESTS):
+            client = Client(HTTP_HX_REQUEST='true')
+            client.force_login(self.user)
+            clients.append(client)
+        start = threading.Barrier(len(clients))
+
+        def submit(client):
+            start.wait()
+            try:
+                return client.post(reverse('orders:checkout'), data)
+            finally:
+                connection.close()
+
+        with mock.patch('orders.views.create_stripe_checkout_session',
+                        create_payment):
+            with ThreadPoolExecutor(max_workers=len(clients)) as pool:
+                responses = list(pool.map(submit, clients))
+
+        self.assertEqual(Order.objects.filter(user=self.user).count(), 1)
+        self.assertEqual(len(payments), 1)
+        self.assertEqual({response.get('HX-Redirect') for response in responses},
+                         {f'https://checkout.stripe.invalid/{payments[0]}'})
+        self.product_size.refresh_from_db()
+        self.assertEqual(self.product_size.stock, 4)
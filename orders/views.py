@@ -5,17 +5,30 @@ from django.utils.decorators import method_decorator
 from django.http import HttpResponse
 from django.template.response import TemplateResponse
 from django.views.generic import View
+from django.db import transaction
+from .checkout import OutOfStock, checkout_lock, claim_checkout, find_checkout, \
+    place_order, record_checkout, restore_order
 from .forms import OrderForm
-from .models import Order, OrderItem
+from .models import IdempotencyKey, Order, OrderItem
 from cart.views import CartMixin
 from cart.models import Cart
 from main.models import ProductSize
 from django.shortcuts import get_object_or_404
 from decimal import Decimal
 from payment.views import create_stripe_checkout_session
+import uuid
+
+
+def checkout_redirect(request, url):
+    if request.headers.get('HX-Request'):
+        response = HttpResponse(status=200)
+        response['HX-Redirect'] = url
+        return response
+    return redirect(url)
 
 
 @method_decorator(login_required(login_url='/users/login'), name='dispatch')
+@method_decorator(transaction.non_atomic_requests, name='dispatch')
 class CheckoutView(CartMixin, View):
     def get(self, request):
         cart = self.get_cart(request)
@@ -31,8 +44,9 @@ class CheckoutView(CartMixin, View):
         context = {
             'form': form,
             'cart': cart,
-            'cart_items': cart.items.select_related('product', 'product_size__size').order_by('-added_at'),
+            'cart_items': cart.get_items(),
             'total_price': total_price,
+            'idempotency_key': uuid.uuid4().hex,
         }
 
         if request.headers.get('HX-Request'):
@@ -41,6 +55,21 @@ class CheckoutView(CartMixin, View):
 
 
     def post(self, request):
+        # Repeated submits of one form (double clicks, HTMX retries) share
+        # this key and get the first submit's response back.
+        idempotency_key = request.POST.get('idempotency_key') \
+            or request.headers.get('Idempotency-Key') or uuid.uuid4().hex
+        if len(idempotency_key) > IdempotencyKey._meta.get_field('key').max_length:
+            return HttpResponse('Invalid idempotency key', status=400)
+        with checkout_lock(request.user, idempotency_key):
+            return self.submit(request, idempotency_key)
+
+
+    def submit(self, request, idempotency_key):
+        previous = find_checkout(request.user, idempotency_key)
+        if previous is not None:
+            return self.replay(request, previous)
+
         cart = self.get_cart(request)
         payment_provider = request.POST.get('payment_provider')
 
@@ -53,78 +82,86 @@ class CheckoutView(CartMixin, View):
             context = {
                 'form': OrderForm(user=request.user),
                 'cart': cart,
-                'cart_items': cart.items.select_related('product', 'product_size__size').order_by('-added_at'),
+                'cart_items': cart.get_items(),
                 'total_price': cart.subtotal,
                 'error_message': 'Please select a valid payment provider (Stripe or Heleket).',
+                'idempotency_key': idempotency_key,
             }
             if request.headers.get('HX-Request'):
                 return TemplateResponse(request, 'orders/checkout_content.html', context)
             return render(request, 'orders/checkout.html', context)
 
-        total_price = cart.subtotal
         form_data = request.POST.copy()
         if not form_data.get('email'):
             form_data['email'] = request.user.mail
         form = OrderForm(form_data, user=request.user)
 
-        if form.is_valid():
-            order = Order.objects.create(
-                user=request.user,
-                first_name=form.cleaned_data['first_name'],
-                last_name=form.cleaned_data['last_name'],
-                email=form.cleaned_data['email'],
-                company=form.cleaned_data['company'],
-                address1=form.cleaned_data['address1'],
-                address2=form.cleaned_data['address2'],
-                city=form.cleaned_data['city'],
-                country=form.cleaned_data['country'],
-                province=form.cleaned_data['province'],
-                postal_code=form.cleaned_data['postal_code'],
-                phone=form.cleaned_data['phone'],
-                special_instructions='',
-                total_price=total_price,
-                payment_provider=payment_provider,
-            )
-
-            for item in cart.items.select_related('product', 'product_size__size'):
-                OrderItem.objects.create(
-                    order=order,
-                    product=item.product,
-                    size=item.product_size,
-                    quantity=item.quantity,
-                    price=item.product.price or Decimal('0.00')
-                )
+        if form.is_valid() and payment_provider != 'stripe':
+            # Only Stripe can take payments yet; don't leave an unpaid order.
+            return self.checkout_error(request, form, cart,
+                                       'Heleket payments are not available yet.',
+                                       idempotency_key)
 
+        if form.is_valid():
+            # Each step commits on its own, so no stock row stays locked
+            # while the payment provider is called.
             try:
-                if payment_provider == 'stripe':
-                    checkout_session = create_stripe_checkout_session(order, request)
-                    cart.clear()
-                    if request.headers.get('HX-Request'):
-                        response = HttpResponse(status=200)
-                        response['HX-Redirect'] = checkout_session.url
-                        return response
-                    return redirect(checkout_session.url)
+                with transaction.atomic():
+                    previous = claim_checkout(request.user, idempotency_key)
+                    if previous is not None:
+                        return self.replay(request, previous)
+                    order = place_order(cart, request.user, form.cleaned_data,
+                                        payment_provider)
+                    # Deleting the order in restore_order frees the key again.
+                    record_checkout(request.user, idempotency_key, order)
+            except OutOfStock as e:
+                cart.refresh_from_db()
+                return self.checkout_error(request, form, cart, str(e),
+                                           idempotency_key)
 
+            try:
+                checkout_session = create_stripe_checkout_session(order, request)
             except Exception as e:
-                order.delete()
-                context = {
-                    'form': form,
-                    'cart': cart,
-                    'cart_items': cart.items.select_related('product', 'product_size__size').order_by('-added_at'),
-                    'total_price': total_price,
-                    'error_message': f'Payment processing error: {str(e)}',
-                }
-                if request.headers.get('HX-Request'):
-                    return TemplateResponse(request, 'orders/checkout_content.html', context)
-                return render(request, 'orders/checkout.html', context)
+                restore_order(order, cart)
+                cart.refresh_from_db()
+                return self.checkout_error(request, form, cart,
+                                           f'Payment processing error: {str(e)}',
+                                           idempotency_key)
+            record_checkout(request.user, idempotency_key, order,
+                            checkout_session.url)
+            return checkout_redirect(request, checkout_session.url)
         else:
             context = {
                 'form': form,
                 'cart': cart,
-                'cart_items': cart.items.select_related('product', 'product_size__size').order_by('-added_at'),
-                'total_price': total_price,
+                'cart_items': cart.get_items(),
+                'total_price': cart.subtotal,
                 'error_message': f'Please coreect the errors on the form.',
+                'idempotency_key': idempotency_key,
             }
             if request.headers.get('HX-Request'):
                 return TemplateResponse(request, 'orders/checkout_content.html', context)
             return render(request, 'orders/checkout.html', context)
+
+
+    def checkout_error(self, request, form, cart, error_message, idempotency_key):
+        context = {
+            'form': form,
+            'cart': cart,
+            'cart_items': cart.get_items(),
+            'total_price': cart.subtotal,
+            'error_message': error_message,
+            'idempotency_key': idempotency_key,
+        }
+        if request.headers.get('HX-Request'):
+            return TemplateResponse(request, 'orders/checkout_content.html', context)
+        return render(request, 'orders/checkout.html', context)
+
+
+    def replay(self, request, checkout):
+        if checkout.redirect_url:
+            return checkout_redirect(request, checkout.redirect_url)
+        if request.headers.get('HX-Request'):
+            return TemplateResponse(request, 'orders/empty_cart.html',
+                                    {'message': 'Your order has already been placed'})
+        return redirect('main:index')
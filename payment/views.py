@@ -22,16 +22,16 @@ stripe_endpoint_secret = settings.STRIPE_WEBHOOK_SECRET
 
 
 def create_stripe_checkout_session(order, request):
-    cart = CartMixin.get_cart(request)
     line_items = []
-    for item in cart.items.select_related('product', 'product_size'):
+    # The cart is already emptied at this point; bill the order lines.
+    for item in order.items.all():
         line_items.append({
             'price_data': {
                 'currency': 'eur',
                 'product_data': {
-                    'name': f'{item.product.name} - {item.product_size.size.name}',
+                    'name': f'{item.product_name} - {item.size_name}',
                 },
-                'unit_amount': int(item.product.size * 100),
+                'unit_amount': int(item.price * 100),
             },
             'quantity': item.quantity,
         })
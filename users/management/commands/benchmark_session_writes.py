@@ -0,0 +1,68 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test import Client, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from main.management.rollback import rolled_back
+from main.models import ProductSize
+
+
+class Command(BaseCommand):
+    help = 'Count session writes per 1000 page views with the previous ' \
+           'save-every-request setup and the current one'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--views', type=int, default=1000)
+        parser.add_argument('--visitors', type=int, default=20)
+
+
+    def handle(self, *args, **options):
+        product_size = ProductSize.objects.select_related('product') \
+            .filter(stock__gt=0).order_by('-stock', 'id').first()
+        if product_size is None:
+            raise CommandError('Need a product size in stock to fill carts')
+
+        middleware = [name for name in settings.MIDDLEWARE
+                      if name != 'users.middleware.SessionRefreshMiddleware']
+        with override_settings(SESSION_SAVE_EVERY_REQUEST=True,
+                               MIDDLEWARE=middleware):
+            before = self.measure(product_size, options)
+        after = self.measure(product_size, options)
+
+        self.stdout.write(f'{"":<8} {"db writes":>10} {"cookies set":>12}'
+                          f'   (per 1000 page views, {settings.SESSION_ENGINE})')
+        for label, (writes, cookies) in (('before', before), ('after', after)):
+            self.stdout.write(f'{label:<8} {writes:>10.0f} {cookies:>12.0f}')
+
+
+    def measure(self, product_size, options):
+        product = product_size.product
+        paths = [
+            reverse('main:index'),
+            reverse('main:catalog_all'),
+            reverse('main:product_detail', args=[product.slug]),
+            reverse('cart:cart_count'),
+        ]
+        with rolled_back(), override_settings(ALLOWED_HOSTS=['*']):
+            visitors = [Client() for _ in range(options['visitors'])]
+            for client in visitors:
+                client.post(reverse('cart:add_to_cart', args=[product.slug]),
+                            {'size_id': product_size.pk, 'quantity': 1})
+
+            cookies = 0
+            with CaptureQueriesContext(connection) as queries:
+                for view in range(options['views']):
+                    client = visitors[view % len(visitors)]
+                    response = client.get(paths[view % len(paths)])
+                    cookies += settings.SESSION_COOKIE_NAME in response.cookies
+
+            writes = sum(
+                1 for query in queries
+                if 'django_session' in query['sql']
+                and query['sql'].startswith(('INSERT', 'UPDATE'))
+            )
+
+        scale = 1000 / options['views']
+        return writes * scale, cookies * scale
@@ -0,0 +1,30 @@
+from django.core.management.base import BaseCommand, CommandError
+
+
+class Command(BaseCommand):
+    help = 'Rebuild co-purchase recommendations for users and products'
+
+
+    def add_arguments(self, parser):
+        parser.add_argument('--top', type=int, default=12)
+        parser.add_argument('--chunk-size', type=int, default=50_000)
+        parser.add_argument('--user-batch', type=int, default=1_000)
+
+
+    def handle(self, *args, **options):
+        try:
+            import numpy
+            import scipy
+        except ImportError:
+            raise CommandError('build_recommendations needs numpy and scipy')
+
+        from users.recommendations import build_recommendations
+
+        users, products = build_recommendations(
+            top=options['top'],
+            chunk_size=options['chunk_size'],
+            user_batch=options['user_batch'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f'Stored recommendations for {users} users and {products} products'
+        ))
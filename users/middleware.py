@@ -0,0 +1,32 @@
+import time
+
+from django.conf import settings
+from django.utils.deprecation import MiddlewareMixin
+
+
+REFRESHED_AT = '_refreshed_at'
+
+
+class SessionRefreshMiddleware(MiddlewareMixin):
+    """Save an unchanged session only when its expiry draws near.
+
+    Sessions are stamped whenever they are saved. A session that is read but
+    not changed is saved again, which pushes its expiry and cookie forward,
+    only once less than ``SESSION_REFRESH_THRESHOLD`` seconds of its lifetime
+    remain. Must sit right after ``SessionMiddleware``.
+    """
+
+    def process_response(self, request, response):
+        session = getattr(request, 'session', None)
+        if session is None or not session.accessed or session.is_empty():
+            return response
+
+        now = int(time.time())
+        if session.modified:
+            session[REFRESHED_AT] = now
+            return response
+
+        remaining = session.get_expiry_age() - (now - session.get(REFRESHED_AT, 0))
+        if remaining < settings.SESSION_REFRESH_THRESHOLD:
+            session[REFRESHED_AT] = now
+        return response
@@ -1,3 +1,4 @@
+from django.conf import settings
 from django.db import models
 from django.contrib.auth.models import AbstractUser, BaseUserManager
 from django.utils.html import strip_tags
@@ -54,3 +55,37 @@ class CustomUser(AbstractUser):
             value = getattr(self, field)
             if value:
                 setattr(self, field, strip_tags(value))
+
+
+class UserRecommendation(models.Model):
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE,
+                             related_name='recommendations')
+    product = models.ForeignKey('main.Product', on_delete=models.CASCADE,
+                                related_name='user_recommendations')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+
+    class Meta:
+        unique_together = ('user', 'rank')
+
+
+    def __str__(self):
+        return f"#{self.rank} {self.product} for {self.user}"
+
+
+class ProductSimilarity(models.Model):
+    product = models.ForeignKey('main.Product', on_delete=models.CASCADE,
+                                related_name='similarities')
+    similar = models.ForeignKey('main.Product', on_delete=models.CASCADE,
+                                related_name='+')
+    rank = models.PositiveSmallIntegerField()
+    score = models.FloatField()
+
+
+    class Meta:
+        unique_together = ('product', 'rank')
+
+
+    def __str__(self):
+        return f"#{self.rank} {self.similar} for {self.product}"
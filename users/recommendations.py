@@ -0,0 +1,125 @@
+"""Item-item co-purchase recommendations.
+
+Order lines are streamed in primary-key chunks into a sparse binary
+user x product matrix. Products are compared with cosine similarity and
+users are scored against the products they bought. NumPy and SciPy are
+only needed here, so the web workers never import them.
+"""
+from django.db import transaction
+from orders.models import OrderItem
+
+from .models import ProductSimilarity, UserRecommendation
+
+
+def stream_purchases(chunk_size):
+    """Yield ``(user_ids, product_ids)`` arrays for every chunk of order lines."""
+    import numpy as np
+
+    last_id = 0
+    while True:
+        rows = list(
+            OrderItem.objects.filter(id__gt=last_id, product__isnull=False)
+            .exclude(order__status='cancelled')
+            .order_by('id')
+            .values_list('id', 'order__user_id', 'product_id')[:chunk_size]
+        )
+        if not rows:
+            break
+        chunk = np.array(rows, dtype=np.int64)
+        last_id = int(chunk[-1, 0])
+        yield chunk[:, 1], chunk[:, 2]
+
+
+def build_purchase_matrix(chunk_size):
+    import numpy as np
+    from scipy import sparse
+
+    # Only the distinct (user, product) pairs are kept between chunks, so
+    # memory grows with the matrix rather than with the order lines.
+    pairs = np.empty((0, 2), dtype=np.int64)
+    for user_ids, product_ids in stream_purchases(chunk_size):
+        pairs = np.unique(
+            np.concatenate([pairs, np.column_stack([user_ids, product_ids])]),
+            axis=0,
+        )
+    if not len(pairs):
+        return None, None, None
+
+    user_ids, user_index = np.unique(pairs[:, 0], return_inverse=True)
+    product_ids, product_index = np.unique(pairs[:, 1], return_inverse=True)
+    matrix = sparse.csr_matrix(
+        (np.ones(len(pairs), dtype=np.float32), (user_index, product_index)),
+        shape=(len(user_ids), len(product_ids)),
+    )
+    return matrix, user_ids, product_ids
+
+
+def item_similarity(matrix):
+    import numpy as np
+    from scipy import sparse
+
+    norms = np.sqrt(np.asarray(matrix.sum(axis=0)).ravel())
+    norms[norms == 0] = 1
+    scale = sparse.diags(1 / norms)
+    similarity = (scale @ (matrix.T @ matrix) @ scale).tocsr()
+    similarity.setdiag(0)
+    similarity.eliminate_zeros()
+    return similarity
+
+
+def top_k(row, k):
+    """Return the column indices and values of the k largest entries."""
+    import numpy as np
+
+    if row.nnz == 0:
+        return np.array([], dtype=int), np.array([])
+    indices, values = row.indices, row.data
+    if len(values) > k:
+        best = np.argpartition(-values, k)[:k]
+        indices, values = indices[best], values[best]
+    order = np.argsort(-values, kind='stable')
+    return indices[order], values[order]
+
+
+def build_recommendations(top=12, chunk_size=50_000, user_batch=1_000):
+    matrix, user_ids, product_ids = build_purchase_matrix(chunk_size)
+    if matrix is None:
+        return 0, 0
+
+    similarity = item_similarity(matrix)
+
+    with transaction.atomic():
+        ProductSimilarity.objects.all().delete()
+        rows = []
+        for item in range(similarity.shape[0]):
+            columns, scores = top_k(similarity.getrow(item), top)
+            rows.extend(
+                ProductSimilarity(product_id=int(product_ids[item]),
+                                  similar_id=int(product_ids[column]),
+                                  rank=rank, score=float(score))
+                for rank, (column, score) in enumerate(zip(columns, scores), 1)
+            )
+        ProductSimilarity.objects.bulk_create(rows, batch_size=5_000)
+
+        UserRecommendation.objects.all().delete()
+        users = 0
+        for start in range(0, matrix.shape[0], user_batch):
+            purchased = matrix[start:start + user_batch]
+            scores = (purchased @ similarity).tocsr()
+            # Never recommend what the user has already bought.
+            scores = scores - scores.multiply(purchased)
+            scores.eliminate_zeros()
+
+            rows = []
+            for offset in range(scores.shape[0]):
+                columns, values = top_k(scores.getrow(offset), top)
+                rows.extend(
+                    UserRecommendation(user_id=int(user_ids[start + offset]),
+                                       product_id=int(product_ids[column]),
+                                       rank=rank, score=float(value))
+                    for rank, (column, value) in enumerate(zip(columns, values), 1)
+                )
+            UserRecommendation.objects.bulk_create(rows, batch_size=5_000)
+            users += scores.shape[0]
+
+    return users, similarity.shape[0]
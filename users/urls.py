@@ -10,5 +10,7 @@ urlpatterns = [
     path('account-details/', views.account_details, name='account_details'),
     path('edit-account-details/', views.edit_account_details, name='edit_account_details'),
     path('update-account-details/', views.update_account_details, name='update_account_details'),
+    path('order-history/', views.order_history, name='order_history'),
+    path('order/<int:order_id>/', views.order_detail, name='order_detail'),
     path('logout/', views.logout, name='logout'),
 ]
\ No newline at end of file
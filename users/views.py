@@ -1,4 +1,4 @@
-from django.shortcuts import render, redirect
+from django.shortcuts import render, redirect, get_object_or_404
 from django.contrib.auth import login, authenticate, logout
 from django.contrib.auth.decorators import login_required
 from django.urls import reverse
@@ -8,7 +8,25 @@ from .forms import CustomUserCreationForm, CustomUserLoginForm, \
     CustomUserUpdateForm
 from .models import CustomUser
 from django.contrib import messages
+from django.db.models import Prefetch
 from main.models import Product
+from main.pagination import paginate_keyset
+from orders.models import Order, OrderItem
+from cart.middleware import attach_user_cart, cart_session_key
+
+
+ORDERS_PER_PAGE = 10
+
+
+def user_orders(user):
+    items = OrderItem.objects.order_by('id')
+    return Order.objects.filter(user=user) \
+        .prefetch_related(Prefetch('items', queryset=items))
+
+
+def order_history_page(request):
+    return paginate_keyset(user_orders(request.user), request.GET.get('cursor'),
+                           ORDERS_PER_PAGE)
 
 
 def register(request):
@@ -16,7 +34,9 @@ def register(request):
         form = CustomUserCreationForm(request.POST)
         if form.is_valid():
             user = form.save()
+            previous_session_key = cart_session_key(request)
             login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+            attach_user_cart(request, previous_session_key)
             return redirect('main:index')
     else:
         form = CustomUserCreationForm()
@@ -28,7 +48,9 @@ def login_view(request):
         form = CustomUserLoginForm(request=request, data=request.POST)
         if form.is_valid():
             user = form.get_user()
+            previous_session_key = cart_session_key(request)
             login(request, user, backend='django.contrib.auth.backends.ModelBackend')
+            attach_user_cart(request, previous_session_key)
             return redirect('main:index')
         else:
             form = CustomUserLoginForm()
@@ -47,15 +69,40 @@ def profile_view(request):
     else:
         form = CustomUserUpdateForm(instance=request.user)
 
-    recommended_products = Product.objects.all().order_by('id')[:3]
+    recommended_products = list(Product.objects.filter(
+        user_recommendations__user=request.user
+    ).order_by('user_recommendations__rank')[:3])
+    if not recommended_products:
+        recommended_products = Product.objects.all().order_by('id')[:3]
+
+    page = order_history_page(request)
 
     return TemplateResponse(request, 'users/profile.html', {
         'form': form,
         'user': request.user,
-        'recommended_products': recommended_products
+        'recommended_products': recommended_products,
+        'page': page,
+        'latest_order': page.object_list[0] if page.object_list else None,
     })
 
 
+@login_required(login_url='/users/login')
+def order_history(request):
+    if not request.headers.get('HX-Request'):
+        return redirect('users:profile')
+    template = 'users/partials/order_history_page.html' if request.GET.get('cursor') \
+        else 'users/partials/order_history_content.html'
+    return TemplateResponse(request, template, {'page': order_history_page(request)})
+
+
+@login_required(login_url='/users/login')
+def order_detail(request, order_id):
+    if not request.headers.get('HX-Request'):
+        return redirect('users:profile')
+    order = get_object_or_404(user_orders(request.user), id=order_id)
+    return TemplateResponse(request, 'users/partials/order_detail.html', {'order': order})
+
+
 @login_required(login_url='/users/login')
 def account_details(request):
     user = CustomUser.objects.get(id=request.user.id)